@@ -1,4 +1,8 @@
 import os, sys
+import argparse
+import json
+import math
+import multiprocessing
 import threading
 import time
 from PIL import Image, ImageTk
@@ -8,7 +12,7 @@ from tkinter import filedialog, messagebox
 from aux_func import *
 
 class ImageCyclerApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, compose_workers=0):
         super().__init__()
 
         self.title("Image Cycler")
@@ -26,15 +30,62 @@ class ImageCyclerApp(ctk.CTk):
         # Initialize variables
         self.image_list = []
         self.current_image_index = 0
-        self.cycle_interval = 3  # Default cycle interval in seconds
+        self.cycle_interval = 3  # Default cycle interval in seconds, fractions allowed
         self.images_per_board = 3  # Default number of images per mood board
+        self.root_folder = None
+        self.subfolders = []
         self.selected_folder = None
+        self.folder_watcher = None
+        self.listing_stop = None  # Set to abandon a folder listing still streaming in
         self.zoom_factor = 1.0
         self.image_origin = (0, 0)
         self.drag_start = None
         self.current_image = None
-
-        self.stop_event = threading.Event()  # Event to signal stopping of the thread
+        self.pyramid = None
+        self.canvas_item = None  # The one canvas image item boards are drawn into
+        self.rendered_origin = (0, 0)  # image_origin at the time the canvas item was last rendered
+        self.rendered_margin = (0, 0)  # Extra pixels rendered around the canvas so small pans need no render
+        self.preview_job = None  # Pending coalesced preview render
+        self.refine_job = None  # Pending high-quality render once input stops
+        self.preview_resample = Image.Resampling.BILINEAR
+        self.refine_delay_ms = 150
+        self.canvas_size = (1, 1)
+        self.board_oversample = 2  # Boards are built at this multiple of the canvas size, so zooming in stays sharp
+        self.layout_modes = {"Packed": "maxrects", "Rows": "rows"}  # Board layouts offered in the UI
+        self.transition_started = None  # perf_counter() of the navigation whose board is not on screen yet
+        self.timings_overlay = None  # (background, text) canvas items while the timings overlay is shown
+        self.timings_job = None  # Pending refresh of the overlay
+        self.session_job = None  # Pending save of the session
+        self.unrestored_session = None  # The last run's session while its root folder is out of reach, saved back as it was
+        self.layout_mode = "maxrects"
+        self.relayout_job = None  # Pending rebuild of the board for a new canvas size
+
+        # Index of every image under the roots we have opened, rescanned incrementally in the background
+        self.library = LibraryIndex()
+
+        # Reduced decodes of the references, kept on local disk so the NAS is only read once
+        self.thumb_cache = ThumbnailCache(max_bytes=1024 * 1024 * 1024)
+
+        # One memory budget for every decoded image the viewer holds: reduced references, composed boards and zoom tiles
+        self.canvas_pool = CanvasPool()
+        self.image_cache = ImageLRU(max_bytes=768 * 1024 * 1024, on_evict=self.canvas_pool.recycle)
+
+        # Optionally compose boards in worker processes, handed back through shared memory
+        self.composer = SharedBoardComposer(compose_workers, self.thumb_cache) if compose_workers else None
+
+        # Layouts and composed boards, so revisiting a board or resizing the window skips the work already done
+        self.board_cache = BoardCache(pool=self.canvas_pool, image_cache=self.image_cache, composer=self.composer)
+
+        # Worker pool that builds the next and previous boards while the current one is on screen;
+        # with a composer its threads only wait on processes, so there is one per process
+        self.prefetcher = BoardPrefetcher(self.build_board, ahead=2, behind=1, workers=max(2, compose_workers),
+                                          lookup=self.lookup_board, release=self.canvas_pool.release)
+
+        # Finished boards and requests from the cycling thread reach Tk only through this, on the main thread
+        self.scheduler = RenderScheduler(self)
+
+        # Board changes while cycling, on fixed deadlines with the next board prepared ahead of each one
+        self.cycle_clock = CycleClock(self, self.cycle_interval, self.prepare_next_board, self.advance_board, on_miss=self.report_missed_deadline)
 
         # Create and place widgets in a grid layout
         self.grid_columnconfigure(0, weight=1)
@@ -75,6 +126,14 @@ class ImageCyclerApp(ctk.CTk):
 
         self.cycle_switch = ctk.CTkSwitch(self, text="Cycle", command=self.toggle_cycling)
         self.cycle_switch.grid(row=1, column=3, padx=20, pady=20, sticky="ew")
+
+        self.layout_selection = ctk.CTkComboBox(self, values=list(self.layout_modes), command=self.set_layout_mode)
+        self.layout_selection.set("Packed")
+        self.layout_selection.grid(row=1, column=4, padx=20, pady=10, sticky="ew")
+
+        # Says so when boards are too big to pack and are laid out in rows instead
+        self.layout_note = ctk.CTkLabel(self, text="")
+        self.layout_note.grid(row=1, column=5, padx=20, pady=10, sticky="w")
         
         self.canvas = ctk.CTkCanvas(self, background="black")
         self.canvas.grid(row=2, column=0, columnspan=8, padx=20, pady=20, sticky="nsew")
@@ -87,67 +146,386 @@ class ImageCyclerApp(ctk.CTk):
         self.canvas.bind("<ButtonPress-1>", self.start_drag)
         self.canvas.bind("<B1-Motion>", self.drag_image)
         self.canvas.bind("<ButtonRelease-1>", self.stop_drag)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        self.bind("<F3>", self.toggle_timings_overlay)
+        self.bind("<Shift-F3>", lambda event: self.dump_timings(os.path.join(app_data_dir("timings"), time.strftime("timings_%Y%m%d_%H%M%S.json"))))
 
         # Bind Enter key to save settings
         self.bind("<Return>", lambda event: self.save_settings())
 
-        # Start the image cycling in a separate thread
-        self.cycling_thread = threading.Thread(target=self.cycle_images, daemon=True)
-        self.cycling_thread.start()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Pick up where the last run stopped; cycling starts with the window unless it was switched off last time
+        self.cycle_switch.select()
+        self.restore_session()
+        self.toggle_cycling()
 
     def toggle_cycling(self):
         if self.cycle_switch.get() == 1:  # Switch is ON
-            self.stop_event.clear()
-            self.cycling_thread = threading.Thread(target=self.cycle_images, daemon=True)
-            self.cycling_thread.start()
+            self.cycle_clock.start()
             self.cycle_switch.configure(text="Stop")
         else:  # Switch is OFF
-            self.stop_event.set()
+            self.cycle_clock.stop()
             self.cycle_switch.configure(text="Cycle")
+        self.schedule_session_save()
 
     def stop_cycling(self):
-        self.stop_event.set()
+        self.cycle_clock.stop()
+
+    def on_close(self):
+        self.stop_cycling()
+        if self.folder_watcher:
+            self.folder_watcher.stop()
+        if self.timings_job is not None:
+            self.after_cancel(self.timings_job)
+        if self.session_job is not None:
+            self.after_cancel(self.session_job)
+        self.save_session()
+        self.prefetcher.shutdown()
+        if self.composer:
+            self.composer.shutdown()
+        self.destroy()
+
+    def session_state(self):
+        if self.root_folder is None and self.unrestored_session:
+            # Nothing opened yet and the saved root is not there (a NAS that mounts late): don't overwrite it with nothing
+            return dict(self.unrestored_session, cycling=self.cycle_switch.get() == 1)
+        return {
+            "root_folder": self.root_folder,
+            "selected_folder": self.selected_folder,
+            "current_image_index": self.current_image_index,
+            "board": board_paths(self.image_list, self.current_image_index, self.images_per_board) if self.image_list else [],
+            "cycle_interval": self.cycle_interval,
+            "images_per_board": self.images_per_board,
+            "layout_mode": self.layout_mode,
+            "canvas_size": list(self.canvas_size),
+            "cycling": self.cycle_switch.get() == 1,
+        }
+
+    def schedule_session_save(self):
+        # Navigation can be several times a second while cycling; the file is written once things settle
+        if self.session_job is None:
+            self.session_job = self.after(1000, self.save_session)
+
+    def save_session(self):
+        self.session_job = None
+        try:
+            save_session(self.session_state())
+        except OSError as e:
+            print(f"Could not save the session: {e}")
+
+    def restore_session(self):
+        session = load_session()
+        if not session.get("cycling", True):
+            self.cycle_switch.deselect()
+        root = session.get("root_folder")
+        if not isinstance(root, str) or not os.path.isdir(root):
+            if root:
+                self.unrestored_session = session
+            return
+
+        # Checked like save_settings checks the entries; anything unusable keeps the default
+        try:
+            interval = max(0.1, float(session.get("cycle_interval", self.cycle_interval)))
+            if math.isfinite(interval):
+                self.cycle_interval = interval
+        except (TypeError, ValueError):
+            pass
+        try:
+            self.images_per_board = max(1, int(session.get("images_per_board", self.images_per_board)))
+        except (TypeError, ValueError):
+            pass
+        self.cycle_clock.interval = self.cycle_interval
+        self.interval_entry.delete(0, "end")
+        self.interval_entry.insert(0, str(self.cycle_interval))
+        self.images_per_board_entry.delete(0, "end")
+        self.images_per_board_entry.insert(0, str(self.images_per_board))
+        for label, mode in self.layout_modes.items():
+            if mode == session.get("layout_mode"):
+                self.layout_mode = mode
+                self.layout_selection.set(label)
+        self.update_layout_note()
+        try:
+            # The window comes back at its old size, so the board can be built before the canvas is laid out
+            width, height = (int(v) for v in session.get("canvas_size") or ())
+            if width > 1 and height > 1:
+                self.canvas_size = (width, height)
+        except (TypeError, ValueError):
+            pass
+        try:
+            index = max(0, int(session.get("current_image_index", 0)))
+        except (TypeError, ValueError):
+            index = 0
+
+        self.root_folder = root
+        folder = session.get("selected_folder")
+        if not isinstance(folder, str):
+            folder = None
+        saved_board = session.get("board")
+        board = [path for path in saved_board if isinstance(path, str) and os.path.isfile(path)] if isinstance(saved_board, list) else []
+        if folder:
+            self.selected_folder = folder
+            self.folder_selection.set(self.folder_label(folder))
+        if board:
+            # The saved board right away: indexed dimensions and the thumbnail cache make it a local job, no listing needed
+            self.image_list = board
+            self.current_image_index = 0
+            self.update_image()
+
+        # The folder is listed and rescanned behind it
+        threading.Thread(target=self.revalidate_session, args=(root, folder, index), daemon=True).start()
+
+    def revalidate_session(self, root, folder, index):
+        # Runs on a background thread: first what the index already knows, then again once it is rescanned
+        if folder and self.library.is_indexed(folder):
+            self.scheduler.post(self.resume_session, root, folder, self.library.images(folder), index)
+        self.scan_library(root)
+        if folder:
+            self.scheduler.post(self.resume_session, root, folder, self.library.images(folder), index)
+
+    def resume_session(self, root, folder, paths, index):
+        if root != self.root_folder or folder != self.selected_folder:
+            return  # Something else was picked in the meantime
+        self.refresh_subfolders(root)
+        if folder != self.selected_folder or folder not in self.subfolders:
+            return  # The folder is gone; refresh_subfolders moved on to another one
+        if self.listing_stop:
+            self.listing_stop.set()  # The index has the full listing now
+
+        # Keep showing the same board: find it in the fresh listing, fall back to the saved position
+        shown = board_paths(self.image_list, self.current_image_index, self.images_per_board) if self.image_list else []
+        position = {path: i for i, path in enumerate(paths)}
+        self.image_list = list(paths)
+        if shown and shown[0] in position:
+            self.current_image_index = position[shown[0]]
+        elif self.image_list:
+            self.current_image_index = min(index, len(self.image_list) - 1)
+        if self.folder_watcher is None:
+            self.watch_folder(folder)
+
+        if not self.image_list:
+            return
+        if board_paths(self.image_list, self.current_image_index, self.images_per_board) != shown:
+            self.update_image()
+        else:
+            # Same board: just warm up the ones around it
+            self.prefetcher.set_context(self.board_context())
+            self.prefetcher.prefetch(self.image_list, self.current_image_index, self.images_per_board)
+
+    def cache_stats(self):
+        # Hit rate and bytes resident of the shared image cache, broken down by kind of entry
+        return self.image_cache.stats()
+
+    def on_canvas_resize(self, event):
+        self.canvas_size = (event.width, event.height)
+        if self.current_image is not None:
+            # Stretch the current board right away, lay it out again for the new shape once resizing settles
+            self.request_render()
+            if self.relayout_job is not None:
+                self.after_cancel(self.relayout_job)
+            self.relayout_job = self.after(150, self.relayout)
+
+    def relayout(self):
+        self.relayout_job = None
+        self.update_image()
+
+    def set_layout_mode(self, choice):
+        self.layout_mode = self.layout_modes[choice]
+        self.update_layout_note()
+        self.update_image()
+
+    def board_layout_mode(self):
+        # Packing more than MAX_PACKED_IMAGES takes too long to keep up with cycling, so such boards use rows
+        if self.layout_mode != "rows" and self.images_per_board > MAX_PACKED_IMAGES:
+            return "rows"
+        return self.layout_mode
+
+    def update_layout_note(self):
+        if self.board_layout_mode() != self.layout_mode:
+            self.layout_note.configure(text=f"Rows: more than {MAX_PACKED_IMAGES} images per board")
+        else:
+            self.layout_note.configure(text="")
+
+    def board_context(self):
+        # Anything that changes here makes every prefetched board stale
+        return (self.selected_folder, self.images_per_board, self.canvas_size, self.board_layout_mode())
 
     def select_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
-            self.subfolders = [f.path for f in os.scandir(folder_path) if f.is_dir()]
-            self.folder_selection.configure(values=[os.path.basename(f) for f in self.subfolders])
+            self.root_folder = os.path.abspath(folder_path)
             self.current_image_index = 0
-            if self.subfolders:
-                self.folder_selection.set(os.path.basename(self.subfolders[0]))
-                self.update_selected_folder()
-            else:
-                messagebox.showerror("Error", "No subfolders found in the selected folder")
+            self.refresh_subfolders(self.root_folder, select_first=True)
+
+            # Bring the index up to date without holding up the window
+            threading.Thread(target=self.index_root, args=(self.root_folder,), daemon=True).start()
         else:
             messagebox.showinfo("Info", "No folder selected")
 
+    def scan_library(self, root):
+        started = time.time()
+        self.library.scan(root)
+        print(f"Indexed {root} in {time.time() - started:.1f}s")
+
+    def index_root(self, root):
+        self.scan_library(root)
+        self.scheduler.post(self.reload_folder, root)
+
+    def reload_folder(self, root):
+        # After a rescan the selected folder may hold files added or removed while the app was closed:
+        # merge its fresh listing in, keeping the current board
+        if root != self.root_folder:
+            return
+        folder = self.selected_folder
+        self.resume_session(root, folder, self.library.images(folder) if folder else [], self.current_image_index)
+
+    def folder_label(self, folder):
+        return os.path.relpath(folder, self.root_folder) if folder != self.root_folder else os.path.basename(folder)
+
+    def refresh_subfolders(self, root, select_first=False):
+        if root != self.root_folder:
+            return  # Another root was picked while this one was indexing
+
+        if self.library.is_indexed(root):
+            self.subfolders = self.library.folders(root)
+        else:
+            # Not indexed yet: show the top level straight away, the full tree follows once the scan is done
+            self.subfolders = [f.path for f in os.scandir(root) if f.is_dir()]
+        self.folder_selection.configure(values=[self.folder_label(f) for f in self.subfolders])
+
+        if not self.subfolders:
+            if select_first:
+                messagebox.showerror("Error", "No subfolders found in the selected folder")
+        elif select_first or self.selected_folder not in self.subfolders:
+            self.folder_selection.set(self.folder_label(self.subfolders[0]))
+            self.update_selected_folder()
+
     def update_selected_folder(self, event=None):
         selection = self.folder_selection.get()
         if selection:
-            selected_path = [f for f in self.subfolders if os.path.basename(f) == selection]
+            selected_path = [f for f in self.subfolders if self.folder_label(f) == selection]
             if selected_path:
+                if selected_path[0] != self.selected_folder:
+                    self.watch_folder(selected_path[0])
                 self.selected_folder = selected_path[0]
-                self.image_list = [os.path.join(self.selected_folder, f) for f in os.listdir(self.selected_folder) if f.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'bmp'))]
                 self.current_image_index = 0  # Reset the image index
-                print(f"Selected folder: {self.selected_folder}, Number of images: {len(self.image_list)}")
-                if self.image_list:
-                    self.update_image()
+                if self.listing_stop:
+                    self.listing_stop.set()
+
+                if self.library.is_indexed(self.selected_folder):
+                    self.image_list = []
+                    with stage_timings.timed("listing"):
+                        paths = self.library.images(self.selected_folder)
+                    self.extend_image_list(self.selected_folder, paths, True)
                 else:
-                    messagebox.showerror("Error", "No images found in the selected subfolder")
+                    # Not indexed: stream the listing and show the first board as soon as it can be filled
+                    self.image_list = []
+                    self.listing_stop = threading.Event()
+                    threading.Thread(target=self.stream_folder, args=(self.selected_folder, self.listing_stop), daemon=True).start()
         else:
             self.selected_folder = None
 
+    def stream_folder(self, folder, stop):
+        # Runs on a listing thread; the first chunk is just big enough for one board, the rest follow in bulk
+        chunk = []
+        chunk_size = self.images_per_board
+        started = time.perf_counter()
+        try:
+            for path in iter_images(folder):
+                if stop.is_set():
+                    return
+                chunk.append(path)
+                if len(chunk) >= chunk_size:
+                    self.scheduler.post(self.extend_image_list, folder, chunk, False)
+                    chunk = []
+                    chunk_size = 1000
+        except OSError as e:
+            print(f"Could not list {folder}: {e}")
+        if not stop.is_set():
+            stage_timings.record("listing", time.perf_counter() - started)
+            self.scheduler.post(self.extend_image_list, folder, chunk, True)
+
+    def extend_image_list(self, folder, paths, done):
+        if folder != self.selected_folder:
+            return
+        had_board = len(self.image_list) >= self.images_per_board
+
+        # The watcher may already have added some of these
+        known = set(self.image_list)
+        self.image_list.extend(path for path in paths if path not in known)
+
+        if done:
+            print(f"Selected folder: {self.selected_folder}, Number of images: {len(self.image_list)}")
+            if not self.image_list:
+                messagebox.showerror("Error", "No images found in the selected subfolder")
+        if not had_board and (len(self.image_list) >= self.images_per_board or (done and self.image_list)):
+            self.update_image()
+
+    def watch_folder(self, folder):
+        if self.folder_watcher:
+            self.folder_watcher.stop()
+        # Changes arrive on the watcher thread and are applied on the main thread
+        self.folder_watcher = FolderWatcher(folder, lambda added, removed, renamed: self.scheduler.post(self.apply_folder_changes, folder, added, removed, renamed))
+        self.folder_watcher.start()
+
+    def apply_folder_changes(self, folder, added, removed, renamed):
+        if folder != self.selected_folder:
+            return
+        current_board = set(board_paths(self.image_list, self.current_image_index, self.images_per_board))
+        position = {path: i for i, path in enumerate(self.image_list)}
+        # A file written again in place shows up as added although it is already listed: it stays put, but every
+        # board, layout and decode made from its old contents is stale
+        rewritten = {path for path in added if path in position}
+
+        # Renamed files keep their place in the cycle
+        for old_path, new_path in renamed:
+            if old_path in position:
+                self.image_list[position[old_path]] = new_path
+            else:
+                added.append(new_path)
+
+        # Removing entries before the current board shifts it down, so it keeps showing the same images
+        removed_indices = sorted((position[path] for path in removed if path in position), reverse=True)
+        for i in removed_indices:
+            del self.image_list[i]
+        self.current_image_index -= sum(1 for i in removed_indices if i < self.current_image_index)
+
+        # New files join the end of the cycle
+        known = set(self.image_list)
+        self.image_list.extend(path for path in added if path not in known)
+        if self.image_list:
+            self.current_image_index %= len(self.image_list)
+        else:
+            self.current_image_index = 0
+
+        stale = set(removed) | {old_path for old_path, _ in renamed} | rewritten
+        self.prefetcher.invalidate(stale)
+        self.board_cache.forget(stale | set(added))
+        print(f"Folder changed: {len(added) - len(rewritten)} added, {len(rewritten)} rewritten, {len(removed)} removed, {len(renamed)} renamed")
+
+        # Only rebuild what is on screen if it changed
+        if current_board & stale or len(current_board) < self.images_per_board:
+            self.update_image()
+        else:
+            self.prefetcher.prefetch(self.image_list, self.current_image_index, self.images_per_board)
+
     def save_settings(self):
         try:
-            self.cycle_interval = int(self.interval_entry.get())
+            self.cycle_interval = max(0.1, float(self.interval_entry.get()))
         except ValueError:
             self.cycle_interval = 3  # Default value if invalid
+        if not math.isfinite(self.cycle_interval):
+            self.cycle_interval = 3  # inf would leave the cycle clock with a NaN deadline
+        if self.cycle_interval != self.cycle_clock.interval:
+            self.cycle_clock.interval = self.cycle_interval
+            if self.cycle_clock.running:
+                self.cycle_clock.start()  # Realign the deadlines to the new interval
 
         try:
-            self.images_per_board = int(self.images_per_board_entry.get())
+            self.images_per_board = max(1, int(self.images_per_board_entry.get()))
         except ValueError:
             self.images_per_board = 3  # Default value if invalid
+        self.update_layout_note()
 
         # Ensure the folder selection is respected
         self.update_selected_folder()
@@ -160,39 +538,60 @@ class ImageCyclerApp(ctk.CTk):
             return
         
         # Select the batch of images for the current mood board
-        start_index = self.current_image_index
-        end_index = start_index + self.images_per_board
-        images_to_display = self.image_list[start_index:end_index]
+        images_to_display = board_paths(self.image_list, self.current_image_index, self.images_per_board)
+
+        # Take the mood board from the prefetch queue; it is shown on the main thread once ready,
+        # unless another navigation has happened by then
+        self.prefetcher.set_context(self.board_context())
+        self.transition_started = time.perf_counter()
+        generation = self.scheduler.next_generation()
+        future = self.prefetcher.request(images_to_display)
+        if future.done() and not future.cancelled() and future.exception() is None:
+            # Prefetched: show it now rather than at the scheduler's next poll
+            self.display_image(future.result())
+        else:
+            self.scheduler.submit(generation, future, self.display_image)
 
-        # Create the mood board image using bin packing
-        mood_board_img = self.create_mood_board(images_to_display)
+        # Start building the boards around this one
+        self.prefetcher.prefetch(self.image_list, self.current_image_index, self.images_per_board)
+        self.schedule_session_save()
 
-        # Resize to fit the UI while maintaining aspect ratio
-        self.display_image(mood_board_img)
+    def build_board(self, images, context):
+        # Runs on a prefetch worker; everything it needs from the UI comes in through context
+        folder, images_per_board, canvas_size, layout_mode = context
+        return self.create_mood_board(images, canvas_size, layout_mode)
 
-    def create_mood_board(self, images):
-        # Load images
-        opened_images = load_images(images)
+    def lookup_board(self, images, context):
+        folder, images_per_board, canvas_size, layout_mode = context
+        return self.board_cache.cached(images, *self.board_size(canvas_size), layout_mode)
 
-        # Define the bin dimensions (you can adjust these values)
-        bin_width = 4096    
-        bin_height = 4096
+    def board_size(self, target_size):
+        # The board takes the canvas' aspect ratio, at board_oversample times its size (at most 4096 on the long side)
+        if target_size and min(target_size) > 1:
+            scale = min(self.board_oversample, 4096 / max(target_size))
+            return int(target_size[0] * scale), int(target_size[1] * scale)
+        return 4096, 4096  # Canvas not laid out yet
 
-        # Apply bin packing
-        bins = bin_packing(opened_images, bin_width, bin_height)
+    def create_mood_board(self, images, target_size=None, layout_mode="maxrects"):
+        bin_width, bin_height = self.board_size(target_size)
 
-        # Create packed image from bins
-        packed_images = create_packed_image(bins)
-        
-        # Assuming one packed image for simplicity
-        return packed_images[0] if packed_images else Image.new('RGBA', (bin_width, bin_height), (255, 255, 255, 0))
+        # Laid out from indexed or header dimensions; pixels are decoded only at their placed size
+        return self.board_cache.board(images, bin_width, bin_height, self.thumb_cache, self.library, layout_mode)
+
+    def prepare_next_board(self):
+        # The cycle clock calls this ahead of each deadline, so the next board is built by the time it is due
+        if not self.image_list:
+            return None
+        self.prefetcher.set_context(self.board_context())
+        next_index = (self.current_image_index + self.images_per_board) % len(self.image_list)
+        return self.prefetcher.request(board_paths(self.image_list, next_index, self.images_per_board))
+
+    def advance_board(self, future):
+        # Same as the right arrow key; the board it asks for is the one prepared for this deadline
+        self.show_next_image(None)
 
-    def cycle_images(self):
-        while not self.stop_event.is_set():
-            if self.image_list:
-                self.current_image_index = (self.current_image_index + self.images_per_board) % len(self.image_list)
-                self.update_image()
-            time.sleep(self.cycle_interval)
+    def report_missed_deadline(self, lateness, ready):
+        print(f"Cycle deadline missed by {lateness * 1000:.0f} ms" + ("" if ready else ", next board was not ready"))
 
     def show_previous_image(self, event):
         if not self.image_list:
@@ -216,7 +615,7 @@ class ImageCyclerApp(ctk.CTk):
             self.zoom_factor /= 1.1
 
         # Resize the image
-        self.display_image(self.current_image)
+        self.request_render()
 
     def reset_zoom(self, event):
         self.zoom_factor = 1.0
@@ -232,36 +631,161 @@ class ImageCyclerApp(ctk.CTk):
             dy = event.y - self.drag_start[1]
             self.image_origin = (self.image_origin[0] + dx, self.image_origin[1] + dy)
             self.drag_start = (event.x, event.y)
-            self.display_image(self.current_image)
+
+            # Panning is a pure translation of what is already drawn
+            if self.canvas_item is not None:
+                self.canvas.move(self.canvas_item, dx, dy)
+            if not self.view_is_covered():
+                self.request_render()
 
     def stop_drag(self, event):
         self.drag_start = None
 
-    def display_image(self, img):
+    def view_is_covered(self):
+        # True while the canvas item still holds every board pixel that falls inside the canvas
+        if self.canvas_item is None or self.current_image is None:
+            return False
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        scale, (board_left, board_top) = self.board_placement()
+
+        # Visible part of the board, in canvas coordinates
+        left = max(0, board_left)
+        top = max(0, board_top)
+        right = min(canvas_width, board_left + self.current_image.width * scale)
+        bottom = min(canvas_height, board_top + self.current_image.height * scale)
+        if right <= left or bottom <= top:
+            return True
+
+        # Area the canvas item covers after the moves since it was rendered
+        shift_x = self.image_origin[0] - self.rendered_origin[0]
+        shift_y = self.image_origin[1] - self.rendered_origin[1]
+        margin_x, margin_y = self.rendered_margin
+        return (shift_x - margin_x <= left and shift_y - margin_y <= top
+                and right <= shift_x + canvas_width + margin_x and bottom <= shift_y + canvas_height + margin_y)
+
+    def board_placement(self):
+        # Scale and top-left corner of the board on the canvas; zoom 1.0 fits the whole board, centred
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        board_width, board_height = self.current_image.size
+        scale = min(canvas_width / board_width, canvas_height / board_height) * self.zoom_factor
+        left = (canvas_width - board_width * scale) / 2 + self.image_origin[0]
+        top = (canvas_height - board_height * scale) / 2 + self.image_origin[1]
+        return scale, (left, top)
+
+    def request_render(self):
+        # Any new input pushes the high-quality pass back
+        if self.refine_job is not None:
+            self.after_cancel(self.refine_job)
+            self.refine_job = None
+
+        # Coalesce zoom and drag events into at most one render per frame
+        if self.preview_job is None:
+            self.preview_job = self.after(16, self.render_preview)
+
+    def render_preview(self):
+        self.preview_job = None
+        self.display_image(self.current_image, self.preview_resample)
+        self.refine_job = self.after(self.refine_delay_ms, self.render_refined)
+
+    def render_refined(self):
+        self.refine_job = None
+        self.display_image(self.current_image)
+
+    def display_image(self, img, resample=Image.Resampling.LANCZOS):
         if img is None:
             return
 
-        self.current_image = img.copy()
-
-        # Resize the image according to the zoom factor
-        width, height = img.size
-        new_width = int(width * self.zoom_factor)
-        new_height = int(height * self.zoom_factor)
-        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # Create a blank image to place the resized image
-        display_img = Image.new("RGBA", (self.canvas.winfo_width(), self.canvas.winfo_height()), (0, 0, 0, 0))
-        display_img.paste(resized_img, (int(self.image_origin[0]), int(self.image_origin[1])))
-
-        # Convert to ImageTk for display
-        tk_img = ImageTk.PhotoImage(display_img)
-        self.canvas.create_image(0, 0, anchor="nw", image=tk_img)
+        if img is not self.current_image:
+            # New board: build its tile pyramid once, every zoom and pan after that draws from it
+            self.current_image = img
+            if self.pyramid is not None:
+                self.pyramid.release()
+            self.pyramid = TilePyramid(img, image_cache=self.image_cache, pool=self.canvas_pool)
+
+        # Render the canvas plus a margin on each side, so short drags are covered by canvas.move alone
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        margin_x, margin_y = canvas_width // 4, canvas_height // 4
+        scale, (board_left, board_top) = self.board_placement()
+        render_origin = (board_left + margin_x, board_top + margin_y)
+        render_size = (canvas_width + 2 * margin_x, canvas_height + 2 * margin_y)
+
+        # Render only the tiles that fall inside that area, from the level nearest the display scale
+        with stage_timings.timed("zoom_resize"):
+            display_img = self.pyramid.render(scale, render_origin, render_size, resample)
+
+        # Convert to ImageTk and swap it into the persistent canvas item
+        with stage_timings.timed("photoimage"):
+            tk_img = ImageTk.PhotoImage(display_img)
+        with stage_timings.timed("blit"):
+            if self.canvas_item is None:
+                self.canvas_item = self.canvas.create_image(-margin_x, -margin_y, anchor="nw", image=tk_img)
+                self.canvas.tag_lower(self.canvas_item)  # Below the timings overlay
+            else:
+                self.canvas.itemconfigure(self.canvas_item, image=tk_img)
+                self.canvas.coords(self.canvas_item, -margin_x, -margin_y)
+            self.canvas.update_idletasks()  # Draw now rather than at the next idle, so the time lands here
         self.canvas.image = tk_img
+        self.rendered_origin = self.image_origin
+        self.rendered_margin = (margin_x, margin_y)
+
+        if self.transition_started is not None:
+            # From the navigation to its board on screen, waiting on the prefetcher included
+            stage_timings.record("transition", time.perf_counter() - self.transition_started)
+            self.transition_started = None
+
+    def timings_text(self):
+        lines = [f"{'stage':<12}{'p50':>8}{'p95':>8}{'max':>8}{'n':>7}"]
+        for stage, summary in stage_timings.summary().items():
+            lines.append(f"{stage:<12}{summary['p50_ms']:>8.1f}{summary['p95_ms']:>8.1f}{summary['max_ms']:>8.1f}{summary['count']:>7}")
+        if self.cycle_clock.ticks:
+            lines.append(f"missed deadlines {self.cycle_clock.misses}/{self.cycle_clock.ticks}")
+        return "\n".join(lines)
+
+    def toggle_timings_overlay(self, event=None):
+        if self.timings_overlay:
+            for item in self.timings_overlay:
+                self.canvas.delete(item)
+            self.timings_overlay = None
+            if self.timings_job is not None:
+                self.after_cancel(self.timings_job)
+                self.timings_job = None
+            return
+        background = self.canvas.create_rectangle(0, 0, 0, 0, fill="black", outline="", stipple="gray50")
+        text = self.canvas.create_text(10, 10, anchor="nw", fill="white", font=("Courier", 10))
+        self.timings_overlay = (background, text)
+        self.refresh_timings_overlay()
+
+    def refresh_timings_overlay(self):
+        # Stages timed on worker threads change without a redraw, so the overlay refreshes on its own
+        self.timings_job = None
+        if not self.timings_overlay:
+            return
+        background, text = self.timings_overlay
+        self.canvas.itemconfigure(text, text=self.timings_text() + "\n(ms, F3 hides, Shift+F3 saves)")
+        left, top, right, bottom = self.canvas.bbox(text)
+        self.canvas.coords(background, left - 6, top - 6, right + 6, bottom + 6)
+        self.canvas.tag_raise(background)
+        self.canvas.tag_raise(text)
+        self.timings_job = self.after(500, self.refresh_timings_overlay)
+
+    def dump_timings(self, path=None):
+        # Stage timings as JSON, also written to path if given
+        dump = json.dumps(stage_timings.summary(), indent=2)
+        if path:
+            with open(path, "w") as f:
+                f.write(dump)
+            print(f"Timings written to {path}")
+        return dump
 
     def focus_app(self):
         self.lift()
         self.focus_force()
 
 if __name__ == "__main__":
-    app = ImageCyclerApp()
+    multiprocessing.freeze_support()  # Composer processes of a frozen build start through this
+    parser = argparse.ArgumentParser(description="Cycle through reference images as mood boards")
+    parser.add_argument("--compose-processes", type=int, default=0, help="Compose boards in this many worker processes (default: in threads)")
+    args = parser.parse_args()
+
+    app = ImageCyclerApp(compose_workers=args.compose_processes)
     app.mainloop()
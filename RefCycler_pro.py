@@ -5,22 +5,10 @@ from PIL import Image, ImageTk, ImageGrab, ImageEnhance
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, scrolledtext
 import base64
-import keyboard
-from openai import OpenAI
-from screeninfo import get_monitors
-from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
 
 from aux_func import *
 
-# Load the .env file
-load_dotenv()
-
-# Read the API key from the environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=api_key)
-
 system_message = """
 ROLE: You are a world-class art director, visual critic, and designer.
 """
@@ -168,7 +156,15 @@ class ImageCyclerApp(ctk.CTk):
         self.cycling_thread = threading.Thread(target=self.cycle_images, daemon=True)
         self.cycling_thread.start()
 
-        # Set up hotkey for screenshot
+        # The global hotkey is registered once the first frame is on screen; openai waits for the first request
+        self.after_idle(lambda: self.after(0, self.start_hotkey_thread))
+
+    def start_hotkey_thread(self):
+        threading.Thread(target=self.register_hotkeys, daemon=True).start()
+
+    def register_hotkeys(self):
+        # Runs on a background thread after the window is drawn
+        import keyboard
         keyboard.add_hotkey('ctrl+shift+a', lambda: [self.focus_app(), self.take_screenshot()])
 
     def open_screen_region_selector(self):
@@ -199,7 +195,7 @@ class ImageCyclerApp(ctk.CTk):
             # Add the current user message to the conversation
             messages.append({"role": "user", "content": user_message})
 
-            response = client.chat.completions.create(
+            response = openai_client().chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 max_tokens=500
@@ -282,7 +278,7 @@ class ImageCyclerApp(ctk.CTk):
             total_length = sum(len(str(message['content'])) for message in messages)
             print(f"Total message length: {total_length} characters")
 
-            response = client.chat.completions.create(
+            response = openai_client().chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 max_tokens=500
@@ -5,20 +5,9 @@ from PIL import Image, ImageGrab
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import base64
-import keyboard
-from openai import OpenAI
-from dotenv import load_dotenv
 
 from aux_func import *
 
-# Load the .env file
-load_dotenv()
-
-# Read the API key from the environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=api_key)
-
 system_message = """
 ROLE: You are a world-class art director, visual critic, and designer.
 """
@@ -140,7 +129,15 @@ class ImageCyclerApp(ctk.CTk):
         # Bind Enter key to save settings
         self.bind("<Return>", lambda event: self.save_settings())
 
-        # Set up hotkey for screenshot
+        # The global hotkey is registered once the first frame is on screen; openai waits for the first request
+        self.after_idle(lambda: self.after(0, self.start_hotkey_thread))
+
+    def start_hotkey_thread(self):
+        threading.Thread(target=self.register_hotkeys, daemon=True).start()
+
+    def register_hotkeys(self):
+        # Runs on a background thread after the window is drawn
+        import keyboard
         keyboard.add_hotkey('ctrl+shift+a', self.initiate_screenshot)
 
     def toggle_cycling(self):
@@ -366,7 +363,7 @@ class ImageCyclerApp(ctk.CTk):
             total_length = sum(len(str(message['content'])) for message in messages)
             print(f"Total message length: {total_length} characters")
 
-            response = client.chat.completions.create(
+            response = openai_client().chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 max_tokens=250
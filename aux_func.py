@@ -2,74 +2,1625 @@
 from PIL import Image, ImageTk, ImageGrab, ImageEnhance
 import customtkinter as ctk
 import base64
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import select
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 
 class Bin:
+    # One board: each image with the (x, y, width, height) rectangle it occupies
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        self.remaining_width = width
-        self.remaining_height = height
-        self.current_x = 0
-        self.current_y = 0
-        self.max_row_height = 0
         self.images = []
 
-    def can_place_image(self, img_width, img_height):
-        if img_width > self.remaining_width:
-            if img_height + self.max_row_height > self.height:
-                return False
-            self.current_x = 0
-            self.current_y += self.max_row_height
-            self.remaining_width = self.width
-            self.max_row_height = 0
-        return img_width <= self.remaining_width and self.current_y + img_height <= self.height
-
-    def place_image(self, img, position):
-        self.images.append((img, position))
-        self.remaining_width -= img.width
-        self.current_x += img.width
-        if img.height > self.max_row_height:
-            self.max_row_height = img.height
+    def place_image(self, img, rect):
+        self.images.append((img, rect))
 
     def is_empty(self):
         return len(self.images) == 0
 
-def load_images(image_paths):
-    images = []
-    for path in image_paths:
-        img = Image.open(path)
-        images.append(img)
-    return images
-
-def bin_packing(images, bin_width, bin_height):
-    bins = []
-
-    for img in images:
-        placed = False
-        for bin in bins:
-            if bin.can_place_image(img.width, img.height):
-                bin.place_image(img, (bin.current_x, bin.current_y))
-                placed = True
+class ShelfPacker:
+    # Rows left to right, top to bottom; the original packer, kept as a baseline for the benchmark
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.x = 0
+        self.y = 0
+        self.row_height = 0
+
+    def insert(self, w, h):
+        x, y, row_height = self.x, self.y, self.row_height
+        if x + w > self.width:
+            x, y, row_height = 0, y + row_height, 0
+        if w > self.width or y + h > self.height:
+            return None
+        self.x, self.y, self.row_height = x + w, y, max(row_height, h)
+        return (x, y)
+
+class SkylinePacker:
+    # Bottom-left skyline: tracks the top edge of what has been placed as horizontal segments
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]  # [x, y, width] segments, left to right
+
+    def fits(self, i, w, h):
+        # Lowest y at which a w x h rectangle can sit starting at segment i
+        x = self.skyline[i][0]
+        if x + w > self.width:
+            return None
+        y = 0
+        width_left = w
+        while width_left > 0:
+            y = max(y, self.skyline[i][1])
+            if y + h > self.height:
+                return None
+            width_left -= self.skyline[i][2]
+            i += 1
+        return y
+
+    def insert(self, w, h):
+        best = None
+        for i in range(len(self.skyline)):
+            y = self.fits(i, w, h)
+            if y is not None:
+                score = (y + h, self.skyline[i][2])  # Lowest top edge, then the narrowest segment
+                if best is None or score < best[0]:
+                    best = (score, i, y)
+        if best is None:
+            return None
+
+        _, i, y = best
+        x = self.skyline[i][0]
+        self.skyline.insert(i, [x, y + h, w])
+
+        # Cut the segments now hidden under the new one
+        j = i + 1
+        while j < len(self.skyline) and self.skyline[j][0] < x + w:
+            segment = self.skyline[j]
+            covered = x + w - segment[0]
+            segment[0] += covered
+            segment[2] -= covered
+            if segment[2] > 0:
+                break
+            del self.skyline[j]
+
+        # Merge neighbours at the same height
+        j = 0
+        while j < len(self.skyline) - 1:
+            if self.skyline[j][1] == self.skyline[j + 1][1]:
+                self.skyline[j][2] += self.skyline.pop(j + 1)[2]
+            else:
+                j += 1
+        return (x, y)
+
+class MaxRectsPacker:
+    # MaxRects with best-short-side-fit: keeps every maximal free rectangle, so nothing placed blocks later space
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free = [(0, 0, width, height)]
+
+    def insert(self, w, h):
+        best = None
+        for fx, fy, fw, fh in self.free:
+            if w <= fw and h <= fh:
+                score = (min(fw - w, fh - h), max(fw - w, fh - h))
+                if best is None or score < best[0]:
+                    best = (score, fx, fy)
+        if best is None:
+            return None
+        _, x, y = best
+        self.split(x, y, w, h)
+        return (x, y)
+
+    def split(self, x, y, w, h):
+        kept = []
+        pieces = []
+        for fx, fy, fw, fh in self.free:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                kept.append((fx, fy, fw, fh))
+                continue
+            # Up to four maximal rectangles remain around the placed one
+            if x > fx:
+                pieces.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                pieces.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                pieces.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                pieces.append((fx, y + h, fw, fy + fh - y - h))
+
+        # Kept rectangles were already maximal, so only the new pieces can be redundant.
+        # Kept ones are compared by their corners, in a plain loop: this runs for every free rectangle on every insert.
+        corners = [(fx, fy, fx + fw, fy + fh) for fx, fy, fw, fh in kept]
+        for i, piece in enumerate(pieces):
+            px, py, pw, ph = piece
+            right, bottom = px + pw, py + ph
+            contained = False
+            for left, top, other_right, other_bottom in corners:
+                if left <= px and top <= py and right <= other_right and bottom <= other_bottom:
+                    contained = True
+                    break
+            if contained:
+                continue
+            for j, (ox, oy, ow, oh) in enumerate(pieces):
+                if (j != i and ox <= px and oy <= py and right <= ox + ow and bottom <= oy + oh
+                        and ((ox, oy, ow, oh) != piece or j < i)):
+                    contained = True
+                    break
+            if not contained:
+                kept.append(piece)
+        self.free = kept
+
+PACKERS = {'maxrects': MaxRectsPacker, 'skyline': SkylinePacker, 'shelf': ShelfPacker}
+
+# Order in which images are offered to the packer
+SORT_KEYS = {
+    'max_side': lambda size: (max(size), size[0] * size[1]),
+    'area': lambda size: size[0] * size[1],
+    'height': lambda size: (size[1], size[0]),
+}
+
+def pack_sizes(sizes, bin_width, bin_height, method='maxrects', sort='max_side'):
+    # (x, y) for every size on one bin, or None if they don't all fit
+    packer = PACKERS[method](bin_width, bin_height)
+    positions = [None] * len(sizes)
+    for i in sorted(range(len(sizes)), key=lambda i: SORT_KEYS[sort](sizes[i]), reverse=True):
+        position = packer.insert(*sizes[i])
+        if position is None:
+            return None
+        positions[i] = position
+    return positions
+
+def fit_layout(sizes, board_width, board_height, method='maxrects', sort='max_side', tolerance=0.02, max_scale=None):
+    # Largest common scale at which every size packs onto the board, then grown to fill it.
+    # max_scale caps the scale, e.g. 1.0 to never enlarge past the images' own pixels.
+    # Returns one (x, y, width, height) per size.
+    if not sizes:
+        return []
+
+    def attempt(scale):
+        scaled = [(max(1, int(w * scale)), max(1, int(h * scale))) for w, h in sizes]
+        positions = pack_sizes(scaled, board_width, board_height, method, sort)
+        return None if positions is None else [(x, y, w, h) for (x, y), (w, h) in zip(positions, scaled)]
+
+    # No packing can beat perfect area coverage, nor let an image outgrow the board
+    upper = min(math.sqrt(board_width * board_height / sum(w * h for w, h in sizes)),
+                min(board_width / w for w, h in sizes), min(board_height / h for w, h in sizes))
+    if max_scale is not None:
+        upper = min(upper, max_scale)
+    best = attempt(upper)
+    low, high = (upper, upper) if best else (0.0, upper)
+    # Good packings come close to the bound, so step down from it in growing strides before bisecting:
+    # a few full repacks instead of one per halving of [0, upper]
+    step = tolerance
+    while best is None and step < 1:
+        scale = upper * (1 - step)
+        best = attempt(scale)
+        if best is None:
+            high = scale
+        else:
+            low = scale
+        step *= 2
+    while best is None or high - low > tolerance * high:
+        if high < 1e-6:
+            raise ValueError(f"{len(sizes)} images can't fit on a {board_width}x{board_height} board")
+        scale = (low + high) / 2
+        rects = attempt(scale)
+        if rects is None:
+            high = scale
+        else:
+            low, best = scale, rects
+
+    # Grow the packed group until it touches the board on one axis
+    used_width = max(x + w for x, y, w, h in best)
+    used_height = max(y + h for x, y, w, h in best)
+    grow = min(board_width / used_width, board_height / used_height)
+    if max_scale is not None:
+        grow = max(1.0, min(grow, max_scale / low))
+    return [(int(x * grow), int(y * grow), int((x + w) * grow) - int(x * grow), int((y + h) * grow) - int(y * grow))
+            for x, y, w, h in best]
+
+def linear_partition(weights, k):
+    # Classic linear partition: split weights into at most k contiguous runs, minimising the largest run sum.
+    # The optimum is found by bisection with a greedy feasibility check, O(n log(1/precision)).
+    def runs_needed(limit):
+        runs, current = 1, 0.0
+        for weight in weights:
+            if current + weight > limit and current > 0:
+                runs += 1
+                current = 0.0
+            current += weight
+        return runs
+
+    total = sum(weights)
+    low, high = max(weights), total
+    while high - low > 1e-9 * total:
+        middle = (low + high) / 2
+        if runs_needed(middle) <= k:
+            high = middle
+        else:
+            low = middle
+
+    # Among partitions within the optimal limit, break each run as close to an even share of the total as possible
+    runs, run, current, done = [], [], 0.0, 0.0
+    for i, weight in enumerate(weights):
+        target = total * (len(runs) + 1) / k
+        if run and (current + weight > high or abs(done + current - target) <= abs(done + current + weight - target)):
+            runs.append(run)
+            done += current
+            run, current = [], 0.0
+        run.append(i)
+        current += weight
+    runs.append(run)
+
+    # Early breaks can push later runs over the limit; plain greedy never does
+    if len(runs) > k or any(sum(weights[i] for i in run) > high * (1 + 1e-9) for run in runs):
+        runs, run, current = [], [], 0.0
+        for i, weight in enumerate(weights):
+            if run and current + weight > high:
+                runs.append(run)
+                run, current = [], 0.0
+            run.append(i)
+            current += weight
+        runs.append(run)
+    return runs
+
+def justified_layout(sizes, board_width, board_height):
+    # Gallery rows: every row is scaled to one shared height so it spans board_width exactly.
+    # Returns one (x, y, width, height) per size.
+    if not sizes:
+        return []
+    aspects = [w / h for w, h in sizes]
+
+    def rows_for(row_count):
+        rows = linear_partition(aspects, row_count)
+        heights = [board_width / sum(aspects[i] for i in row) for row in rows]
+        # Too tall for the board: shrink the whole grid rather than break the rows
+        shrink = min(1.0, board_height / sum(heights))
+        return board_width * sum(heights) * shrink ** 2, rows, heights, shrink
+
+    # Rows of equal aspect sum S/k are board_width * k / S tall, so k rows fill the board height when k^2 = S * H / W.
+    # That only holds when the aspects can be split evenly: with a panorama or a tall strip far fewer rows can be
+    # better, so from the estimate the row count is widened either way for as long as the coverage keeps improving.
+    estimate = min(len(sizes), max(1, round(math.sqrt(sum(aspects) * board_height / board_width))))
+    best = rows_for(estimate)
+    for direction in (-1, 1):
+        row_count = estimate + direction
+        while 1 <= row_count <= len(sizes):
+            candidate = rows_for(row_count)
+            # The estimate's neighbours are always tried, rounding alone can miss by one
+            if candidate[0] <= best[0] and abs(row_count - estimate) > 1:
                 break
-        if not placed:
-            new_bin = Bin(bin_width, bin_height)
-            new_bin.place_image(img, (0, 0))
-            bins.append(new_bin)
+            best = max(best, candidate)
+            row_count += direction
+    _, rows, heights, shrink = best
+    row_width = board_width * shrink
+
+    rects = [None] * len(sizes)
+    y = 0.0
+    for row, height in zip(rows, heights):
+        height *= shrink
+        x = 0.0
+        for i in row:
+            left = int(x)
+            x += aspects[i] * height
+            rects[i] = (left, int(y), int(x) - left, int(y + height) - int(y))
+        rects[row[-1]] = (rects[row[-1]][0], int(y), int(row_width) - rects[row[-1]][0], int(y + height) - int(y))
+        y += height
+    return rects
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class StageTimings:
+    # The last size durations of each stage a board goes through, recorded from any thread
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.buffers = {}  # stage -> deque of seconds, oldest dropped first
+        self.counts = {}  # stage -> recordings since start
+
+    def record(self, stage, seconds):
+        with self.lock:
+            buffer = self.buffers.get(stage)
+            if buffer is None:
+                buffer = self.buffers[stage] = deque(maxlen=self.size)
+            buffer.append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def summary(self):
+        with self.lock:
+            buffers = {stage: list(buffer) for stage, buffer in self.buffers.items()}
+            counts = dict(self.counts)
+        return {stage: {
+            "count": counts[stage],
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "max_ms": max(values) * 1000,
+            "last_ms": values[-1] * 1000,
+        } for stage, values in buffers.items()}
+
+stage_timings = StageTimings()  # Shared by the whole pipeline, so every stage lands in one place
+
+def decode_to_target(img, target_size):
+    # Decode img at exactly target_size, the size it was placed at, letting the decoder do most of the shrinking.
+    # Layouts keep each image's aspect ratio up to rounding, so this never visibly stretches it.
+    target_width, target_height = target_size
+    scale = max(target_width / img.width, target_height / img.height)
+    if scale < 1:
+        # Both reductions stop at or above the target on each axis, so the filter below only ever shrinks
+        if img.format == 'JPEG':
+            # DCT scaling: the JPEG decoder produces a 1/2, 1/4 or 1/8 image directly
+            img.draft(img.mode, tuple(target_size))
+        else:
+            factor = int(1 / scale)
+            if factor > 1:
+                img = normalize_mode(img).reduce(factor)  # reduce() has no palette or bilevel support
+
+    # Finish the last (less than 2x) step with a proper filter, straight to the placed size
+    if img.size != tuple(target_size):
+        return img.resize(tuple(target_size), Image.Resampling.LANCZOS)
+    img.load()
+    return img
+
+def app_data_dir(*parts):
+    # Per-user folder for RefCycler's caches and settings
+    path = os.path.join(os.path.expanduser("~"), ".refcycler", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def session_path():
+    return os.path.join(app_data_dir(), "session.json")
+
+def load_session(path=None):
+    # Whatever the last run saved; a missing or damaged file is just no session
+    try:
+        with open(path or session_path(), encoding="utf-8") as f:
+            session = json.load(f)
+        return session if isinstance(session, dict) else {}
+    except (OSError, ValueError):
+        return {}
 
-    return bins
+def save_session(session, path=None):
+    # Written next to the old file and swapped in, so a crash or power cut mid-write keeps the previous session
+    path = path or session_path()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(session, f, indent=2)
+    os.replace(temp_path, path)
+
+def thumbnail_size(size, target_size):
+    # Thumbnails are cached at a few fixed sizes rather than at every placed size, so a window resize or another
+    # layout still hits: the long side is rounded up to a power of two, never past the image's own size,
+    # and each use shrinks from there
+    long_side = 1 << (max(target_size) - 1).bit_length()
+    scale = min(1.0, long_side / max(size))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+class ThumbnailCache:
+    # On-disk cache of decoded thumbnails keyed by source path, mtime, size and thumbnail_size step, evicted LRU.
+    # With max_bytes None it keeps no budget of its own: composer processes share the directory that way, and report
+    # the entries they wrote or read in self.used for the owning process to account for with add().
+    def __init__(self, cache_dir=None, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir or app_data_dir("thumbs")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (filename, bytes), least recently used first
+        self.total_bytes = 0
+        self.used = []  # (key, filename, bytes) not yet reported, without a budget
+        if max_bytes is None:
+            return
+
+        # Pick up what previous sessions left behind; file mtimes record when an entry was last used
+        existing = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(('.jpg', '.png')):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self.entries[os.path.splitext(name)[0]] = (name, size)
+            self.total_bytes += size
+        self.evict()
+
+    def key(self, path, target_size):
+        # Every target size with the same power-of-two long side shares the entry
+        stat = os.stat(path)
+        step = 1 << (max(target_size) - 1).bit_length()
+        raw = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{step}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, path, target_size):
+        try:
+            key = self.key(path, target_size)
+        except OSError:
+            return None
+        if self.max_bytes is None:
+            return self.get_unaccounted(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+
+        cached_path = os.path.join(self.cache_dir, entry[0])
+        try:
+            with Image.open(cached_path) as img:
+                img.load()
+            os.utime(cached_path)  # Keep the LRU order across sessions
+        except OSError:
+            self.discard(key)
+            return None
+        return img
+
+    def get_unaccounted(self, key):
+        # No entries to go by: whatever file is there, unless the owning process evicts it first
+        for name in (key + '.jpg', key + '.png'):
+            cached_path = os.path.join(self.cache_dir, name)
+            try:
+                with Image.open(cached_path) as img:
+                    img.load()
+                os.utime(cached_path)
+                size = os.path.getsize(cached_path)
+            except OSError:
+                continue
+            with self.lock:
+                self.used.append((key, name, size))
+            return img
+        return None
+
+    def put(self, path, target_size, img):
+        try:
+            key = self.key(path, target_size)
+        except OSError:
+            return
+
+        # JPEG for opaque thumbnails, PNG for anything JPEG can't hold
+        name = key + ('.jpg' if img.mode in ('RGB', 'L', 'CMYK') else '.png')
+        cached_path = os.path.join(self.cache_dir, name)
+        temp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"  # Unique across threads and processes
+        try:
+            if name.endswith('.jpg'):
+                img.save(temp_path, 'JPEG', quality=92)
+            else:
+                img.save(temp_path, 'PNG', compress_level=1)
+            os.replace(temp_path, cached_path)
+            size = os.path.getsize(cached_path)
+        except (OSError, ValueError) as e:
+            print(f"Could not cache thumbnail for {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        if self.max_bytes is None:
+            with self.lock:
+                self.used.append((key, name, size))
+            return
+        self.add([(key, name, size)])
+
+    def add(self, entries):
+        # Counts (key, filename, bytes) entries written or read here or by another process, as the most recently used
+        with self.lock:
+            for key, name, size in entries:
+                if key in self.entries:
+                    self.total_bytes -= self.entries.pop(key)[1]
+                self.entries[key] = (name, size)
+                self.total_bytes += size
+        self.evict()
+
+    def take_used(self):
+        with self.lock:
+            used, self.used = self.used, []
+        return used
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.total_bytes -= entry[1]
+        try:
+            os.remove(os.path.join(self.cache_dir, entry[0]))
+        except OSError:
+            pass
+
+    def evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                key = next(iter(self.entries))
+            self.discard(key)
+
+def normalize_mode(img):
+    # RGB or RGBA only, so pasting onto a board never converts; RGBA only if some pixel is actually see-through
+    if img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info:
+        rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+        if rgba.getchannel('A').getextrema()[0] < 255:
+            return rgba
+        return rgba.convert('RGB')
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def decode_image(path, target_size=None, thumbnail=False):
+    # Decoded in full, at target_size, or with thumbnail at the cached size for target_size;
+    # the file is closed before returning, so the result holds no handle
+    with Image.open(path) as img:
+        if target_size:
+            img = decode_to_target(img, thumbnail_size(img.size, target_size) if thumbnail else target_size)
+        img = normalize_mode(img)
+        img.load()
+    return img
+
+class ImageHandles:
+    # Lazily opened images keep their file open until first drawn. At most max_open of them do;
+    # past that the oldest still-lazy one is read in and its file closed.
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self.lock = threading.Lock()
+        self.handles = OrderedDict()  # id -> weak reference to an image whose file may still be open
+
+    def open(self, path):
+        img = Image.open(path)
+        normalized = normalize_mode(img)
+        if normalized is not img:
+            img.close()  # The converted copy holds the pixels, the source and its file can go
+            return normalized
+
+        key = id(img)
+        # A collected image drops out by itself; no lock here, as this can run from the GC in any thread
+        ref = weakref.ref(img, lambda ref: self.handles.pop(key, None))
+        with self.lock:
+            self.handles[key] = ref
+            overflow = [self.handles.popitem(last=False)[1] for _ in range(len(self.handles) - self.max_open)]
+        for old in overflow:
+            self.settle(old())
+        return img
+
+    def settle(self, img):
+        if img is None:
+            return
+        try:
+            with img:  # Leaving the block closes the file and keeps the pixels
+                img.load()
+        except OSError:
+            img.close()  # Gone or broken since it was opened
+
+    def close_all(self):
+        with self.lock:
+            refs = list(self.handles.values())
+            self.handles.clear()
+        for ref in refs:
+            self.settle(ref())
+
+image_handles = ImageHandles()  # Shared by every lazy load_image
+
+def load_image(path, target_size=None, thumb_cache=None, image_cache=None, handles=None):
+    # Without a target size the image stays lazy: header read now, pixels when first used, with a bounded number of files open.
+    # Reduced decodes come from memory, then from the thumbnail cache, before the original is touched.
+    if not target_size:
+        return (handles or image_handles).open(path)
+    key = ('image', path, tuple(target_size)) if image_cache is not None else None
+    img = image_cache.get(key) if key else None
+    if img is not None:
+        return img
+    with stage_timings.timed("decode"):
+        if thumb_cache:
+            img = thumb_cache.get(path, target_size)
+            if img is None:
+                img = decode_image(path, target_size, thumbnail=True)
+                thumb_cache.put(path, target_size, img)
+            if img.size != tuple(target_size):
+                img = img.resize(tuple(target_size), Image.Resampling.LANCZOS)
+        else:
+            img = decode_image(path, target_size)
+    if key:
+        image_cache.put(key, img)
+    return img
+
+def load_images(image_paths, target_size=None, thumb_cache=None, image_cache=None, handles=None):
+    return [load_image(path, target_size, thumb_cache, image_cache, handles) for path in image_paths]
+
+def bin_packing(images, bin_width, bin_height, method='maxrects'):
+    # Every image goes on a single board, shrunk by a common factor if the group doesn't fit the bin.
+    # Never enlarged: the bin is an upper bound, not a canvas to fill.
+    bin = Bin(bin_width, bin_height)
+    sizes = [img.size for img in images]
+    for img, rect in zip(images, fit_layout(sizes, bin_width, bin_height, method, max_scale=1.0)):
+        bin.place_image(img, rect)
+    return [bin]
 
 def create_packed_image(bins):
     packed_images = []
     for bin in bins:
         if not bin.is_empty():
-            max_width = max(img.width + pos[0] for img, pos in bin.images)
-            max_height = max(img.height + pos[1] for img, pos in bin.images)
-            packed_image = Image.new('RGBA', (max_width, max_height), (255, 255, 255, 0))
-            for img, position in bin.images:
-                packed_image.paste(img, position)
+            max_width = max(x + w for img, (x, y, w, h) in bin.images)
+            max_height = max(y + h for img, (x, y, w, h) in bin.images)
+            # Only carry an alpha channel if something on the board could use it
+            mode = 'RGBA' if any(img.mode != 'RGB' for img, rect in bin.images) else 'RGB'
+            packed_image = Image.new(mode, (max_width, max_height), (255, 255, 255, 0) if mode == 'RGBA' else (0, 0, 0))
+            for img, (x, y, w, h) in bin.images:
+                if img.size != (w, h):
+                    img = img.resize((w, h), Image.Resampling.LANCZOS)
+                packed_image.paste(img, (x, y))
             packed_images.append(packed_image)
     return packed_images
 
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp')
+
+def iter_images(folder):
+    # Yields image paths while the folder is still being read, so callers can start before the listing ends
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+def list_images(folder):
+    return list(iter_images(folder))
+
+def image_size(path):
+    # Reads only the header; returns None for files Pillow can't identify
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+class LibraryIndex:
+    # SQLite index of every image under the reference roots, with size, mtime and pixel dimensions
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(app_data_dir(), "library.sqlite3")
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute("PRAGMA journal_mode=WAL")  # Lets the UI read while a rescan writes
+            db.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, dir TEXT, name TEXT, size INTEGER, mtime_ns INTEGER, width INTEGER, height INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent)")
+            db.execute("CREATE INDEX IF NOT EXISTS images_dir ON images(dir)")
+
+    def connection(self):
+        # One connection per thread, so a background rescan never blocks the UI's queries
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path)
+            self.local.db = db
+        return db
+
+    def is_indexed(self, folder):
+        row = self.connection().execute("SELECT 1 FROM dirs WHERE path = ?", (os.path.abspath(folder),)).fetchone()
+        return row is not None
+
+    def folders(self, root):
+        # Every folder under root (root included) that holds at least one image
+        root = os.path.abspath(root)
+        prefix = os.path.join(root, "")
+        rows = self.connection().execute(
+            "SELECT DISTINCT dir FROM images WHERE dir = ? OR substr(dir, 1, ?) = ? ORDER BY dir",
+            (root, len(prefix), prefix))
+        return [row[0] for row in rows]
+
+    def images(self, folder):
+        rows = self.connection().execute("SELECT path FROM images WHERE dir = ? ORDER BY name", (os.path.abspath(folder),))
+        return [row[0] for row in rows]
+
+    def dimensions(self, paths):
+        # (width, height) for each indexed path; missing entries map to None.
+        # Saving over a file doesn't touch its folder's mtime, so scan() can miss it: each entry is checked against
+        # the file's size and mtime, and a changed file gets its header read again and its row updated.
+        db = self.connection()
+        sizes = {}
+        for path in paths:
+            row = db.execute("SELECT width, height, size, mtime_ns FROM images WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                sizes[path] = None
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                sizes[path] = None
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (row[2], row[3]):
+                sizes[path] = (row[0], row[1])
+                continue
+
+            sizes[path] = image_size(path)
+            try:
+                with db:
+                    if sizes[path] is None:
+                        db.execute("DELETE FROM images WHERE path = ?", (path,))
+                    else:
+                        db.execute("UPDATE images SET size = ?, mtime_ns = ?, width = ?, height = ? WHERE path = ?",
+                                   (stat.st_size, stat.st_mtime_ns, sizes[path][0], sizes[path][1], path))
+            except sqlite3.Error as e:
+                print(f"Could not update the index entry of {path}: {e}")
+        return sizes
+
+    def scan(self, root):
+        # Walks root, re-listing only folders whose mtime changed since the last scan.
+        # A folder's mtime changes when entries are added, removed or renamed in it, not when a file is edited in place.
+        # Its mtime is only stored once its whole subtree has been scanned: an interrupted scan, or a subfolder that
+        # couldn't be listed, leaves it unset so the next scan lists the folder again instead of trusting it.
+        db = self.connection()
+        stack = [(os.path.abspath(root), None, None)]  # (folder, parent, mtime to store once its subtree is done)
+        parents = {}
+        incomplete = set()
+
+        def fail(path):
+            while path is not None and path not in incomplete:
+                incomplete.add(path)
+                path = parents.get(path)
+
+        while stack:
+            path, parent, done_mtime_ns = stack.pop()
+            if done_mtime_ns is not None:
+                with db:
+                    db.execute("UPDATE dirs SET mtime_ns = ? WHERE path = ?",
+                               (None if path in incomplete else done_mtime_ns, path))
+                continue
+
+            parents[path] = parent
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                fail(parent)
+                continue
+
+            row = db.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                # Unchanged: its images are as indexed, only its subfolders still need a look
+                stack.append((path, parent, mtime_ns))
+                stack.extend((child, path, None) for (child,) in db.execute("SELECT path FROM dirs WHERE parent = ?", (path,)))
+                continue
+
+            subfolders = []
+            files = {}
+            try:
+                for entry in os.scandir(path):
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        stat = entry.stat()
+                        files[entry.path] = (entry.name, stat.st_size, stat.st_mtime_ns)
+            except OSError as e:
+                print(f"Could not list {path}: {e}")
+                fail(parent)
+                continue
+
+            with db:
+                known = {p: (size, mtime) for p, size, mtime in db.execute("SELECT path, size, mtime_ns FROM images WHERE dir = ?", (path,))}
+                for gone in known.keys() - files.keys():
+                    db.execute("DELETE FROM images WHERE path = ?", (gone,))
+                for file_path, (name, size, file_mtime) in files.items():
+                    if known.get(file_path) == (size, file_mtime):
+                        continue
+                    dimensions = image_size(file_path)
+                    if dimensions is None:
+                        db.execute("DELETE FROM images WHERE path = ?", (file_path,))
+                        continue
+                    db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (file_path, path, name, size, file_mtime, dimensions[0], dimensions[1]))
+
+                known_subfolders = {child for (child,) in db.execute("SELECT path FROM dirs WHERE parent = ?", (path,))}
+                for gone in known_subfolders - set(subfolders):
+                    self.forget(gone)
+                db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, NULL)", (path, parent))
+            stack.append((path, parent, mtime_ns))
+            stack.extend((child, path, None) for child in subfolders)
+
+    def forget(self, folder):
+        # Drops folder and everything below it
+        prefix = os.path.join(folder, "")
+        db = self.connection()
+        db.execute("DELETE FROM images WHERE dir = ? OR substr(dir, 1, ?) = ?", (folder, len(prefix), prefix))
+        db.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", (folder, len(prefix), prefix))
+
+class FolderWatcher:
+    # Reports images added, removed or renamed in one folder without relisting it; inotify on Linux, polling elsewhere
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_IGNORED = 0x00008000
+    EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+    def __init__(self, folder, on_change, poll_interval=2.0):
+        self.folder = folder
+        self.on_change = on_change  # Called as on_change(added, removed, renamed) on the watcher thread
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        fd = self.inotify_open() if sys.platform.startswith("linux") else None
+        if fd is None:
+            self.poll()
+            return
+        try:
+            self.watch(fd)
+        finally:
+            os.close(fd)
+
+    def inotify_open(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE | self.IN_DELETE_SELF
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def watch(self, fd):
+        while not self.stop_event.is_set():
+            if not select.select([fd], [], [], 0.5)[0]:
+                continue
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            added, removed, renamed = [], [], []
+            moved_from = {}  # cookie -> path, for pairing the two halves of a rename
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & (self.IN_DELETE_SELF | self.IN_IGNORED):
+                    return
+                path = os.path.join(self.folder, name)
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if mask & self.IN_MOVED_FROM:
+                    moved_from[cookie] = path
+                elif mask & self.IN_MOVED_TO and cookie in moved_from:
+                    renamed.append((moved_from.pop(cookie), path))
+                elif mask & (self.IN_MOVED_TO | self.IN_CLOSE_WRITE):
+                    added.append(path)
+                elif mask & self.IN_DELETE:
+                    removed.append(path)
+
+            # A move with no matching arrival left the folder
+            removed.extend(moved_from.values())
+            if added or removed or renamed:
+                self.on_change(added, removed, renamed)
+
+    def listing(self):
+        # path -> (size, mtime) of every image in the folder
+        listing = {}
+        for path in list_images(self.folder):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            listing[path] = (stat.st_size, stat.st_mtime_ns)
+        return listing
+
+    def poll(self):
+        # Fallback: compare listings; renames show up as a remove plus an add, files written in place as an add
+        try:
+            known = self.listing()
+        except OSError:
+            return
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                current = self.listing()
+            except OSError:
+                return
+            added = sorted(path for path, stat in current.items() if known.get(path) != stat)
+            removed = sorted(known.keys() - current.keys())
+            known = current
+            if added or removed:
+                self.on_change(added, removed, [])
+
+def board_paths(image_list, index, images_per_board):
+    # The slice of image_list that makes up the board starting at index
+    if not image_list:
+        return []
+    start = index % len(image_list)
+    return image_list[start:start + images_per_board]
+
+class BoardPrefetcher:
+    # Builds the boards around the current one on a worker pool, so a transition only has to pick up a finished board
+    def __init__(self, build_board, ahead=2, behind=1, workers=2, lookup=None, release=None):
+        self.build_board = build_board  # Called as build_board(paths, context) on a worker thread
+        self.lookup = lookup  # Optional lookup(paths, context) returning an already built board, or None
+        self.release = release  # Optional release(board), called for each board once the prefetcher drops it
+        self.ahead = ahead
+        self.behind = behind
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.context = None
+        self.futures = {}  # tuple(paths) -> Future
+
+    def set_context(self, context):
+        # Context holds everything a board depends on besides its paths (folder, images per board, canvas size)
+        with self.lock:
+            if context == self.context:
+                return
+            self.context = context
+            for future in self.futures.values():
+                self._drop(future)
+            self.futures = {}
+
+    def _drop(self, future):
+        # A board still being built is handed back once it is done
+        future.cancel()
+        if self.release:
+            future.add_done_callback(self._release_result)
+
+    def _release_result(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.release(future.result())
+
+    def _submit(self, paths):
+        future = self.futures.get(paths)
+        if future is None or future.cancelled():
+            board = self.lookup(list(paths), self.context) if self.lookup else None
+            if board is not None:
+                # Already built once: no need to queue behind boards still being prefetched
+                future = Future()
+                future.set_result(board)
+            else:
+                future = self.executor.submit(self.build_board, list(paths), self.context)
+            self.futures[paths] = future
+        return future
+
+    def request(self, paths):
+        # Future for the board made of paths, already finished if it was prefetched
+        with self.lock:
+            return self._submit(tuple(paths))
+
+    def get(self, paths):
+        # Returns the board for paths, waiting for it if it is still being built
+        return self.request(paths).result()
+
+    def prefetch(self, image_list, index, images_per_board):
+        if not image_list:
+            return
+        wanted = []
+        # Current board first, then its neighbours by distance, next before previous
+        for offset in sorted(range(-self.behind, self.ahead + 1), key=lambda o: (abs(o), o < 0)):
+            paths = tuple(board_paths(image_list, index + offset * images_per_board, images_per_board))
+            if paths and paths not in wanted:
+                wanted.append(paths)
+
+        with self.lock:
+            # Drop boards that fell out of the window
+            for paths in list(self.futures):
+                if paths not in wanted:
+                    self._drop(self.futures.pop(paths))
+            for paths in wanted:
+                self._submit(paths)
+
+    def invalidate(self, paths):
+        # Drops the boards that contain any of paths
+        paths = set(paths)
+        with self.lock:
+            for key in [key for key in self.futures if paths.intersection(key)]:
+                self._drop(self.futures.pop(key))
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.futures.values():
+                self._drop(future)
+            self.futures = {}
+        self.executor.shutdown(wait=False)
+
+class TilePyramid:
+    # Power-of-two levels of one board, cut into tiles on demand, so a view only touches the pixels on screen.
+    # Levels and tiles live in an ImageLRU, which can be the viewer's shared one so they count against its budget.
+    serials = itertools.count()
+
+    def __init__(self, board, tile_size=256, image_cache=None, pool=None):
+        self.tile_size = tile_size
+        self.serial = next(TilePyramid.serials)  # Tells this board's entries apart in a shared cache
+        self.cache = image_cache if image_cache is not None else ImageLRU(64 * 1024 * 1024)
+        self.pool = pool  # The CanvasPool the board came from: it is held for as long as it is shown
+        if pool:
+            pool.hold(board)
+
+        # Level 0 is the board itself, each following level is half the size of the previous one
+        self.board = board
+        self.level_sizes = [board.size]
+        while max(self.level_sizes[-1]) > tile_size:
+            width, height = self.level_sizes[-1]
+            self.level_sizes.append(((width + 1) // 2, (height + 1) // 2))
+
+    def level(self, level):
+        if level == 0:
+            return self.board
+        key = ('level', self.serial, level)
+        img = self.cache.get(key)
+        if img is None:
+            img = self.level(level - 1).reduce(2)
+            self.cache.put(key, img)
+        return img
+
+    def tile(self, level, tx, ty):
+        key = ('tile', self.serial, level, tx, ty)
+        tile = self.cache.get(key)
+        if tile is None:
+            width, height = self.level_sizes[level]
+            size = self.tile_size
+            tile = self.level(level).crop((tx * size, ty * size, min((tx + 1) * size, width), min((ty + 1) * size, height)))
+            self.cache.put(key, tile)
+        return tile
+
+    def release(self):
+        # Drop this board's levels and tiles once it is off screen, rather than waiting for them to age out
+        self.cache.discard_where(lambda key: key[0] in ('level', 'tile') and key[1] == self.serial)
+        if self.pool:
+            self.pool.release(self.board)
+            self.pool = None
+
+    def level_for_scale(self, scale):
+        # Smallest level that still has at least one pixel per screen pixel
+        level = 0
+        while level + 1 < len(self.level_sizes) and scale <= 0.5 ** (level + 1):
+            level += 1
+        return level
+
+    def render(self, scale, origin, view_size, resample=Image.Resampling.LANCZOS):
+        # Draw the board at scale, top-left corner at origin, into a view_size image
+        view = Image.new("RGBA", view_size, (0, 0, 0, 0))
+        level = self.level_for_scale(scale)
+        img = self.level(level)
+        level_scale = scale * 2 ** level  # Level pixels to screen pixels
+
+        # Part of the level that lands inside the view, in level pixels
+        left = max(0.0, -origin[0] / level_scale)
+        top = max(0.0, -origin[1] / level_scale)
+        right = min(float(img.width), (view_size[0] - origin[0]) / level_scale)
+        bottom = min(float(img.height), (view_size[1] - origin[1]) / level_scale)
+        if right <= left or bottom <= top:
+            return view
+
+        # Where that part ends up on screen
+        dest_left = int(round(origin[0] + left * level_scale))
+        dest_top = int(round(origin[1] + top * level_scale))
+        dest_width = int(round(origin[0] + right * level_scale)) - dest_left
+        dest_height = int(round(origin[1] + bottom * level_scale)) - dest_top
+        if dest_width <= 0 or dest_height <= 0:
+            return view
+
+        # Assemble only the tiles under the visible part
+        size = self.tile_size
+        tx0, ty0 = int(left // size), int(top // size)
+        tx1, ty1 = math.ceil(right / size), math.ceil(bottom / size)
+        region = Image.new(img.mode, (min(tx1 * size, img.width) - tx0 * size, min(ty1 * size, img.height) - ty0 * size))
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                region.paste(self.tile(level, tx, ty), ((tx - tx0) * size, (ty - ty0) * size))
+
+        box = (left - tx0 * size, top - ty0 * size, right - tx0 * size, bottom - ty0 * size)
+        view.paste(region.resize((dest_width, dest_height), resample, box=box), (dest_left, dest_top))
+        return view
+
+class CycleClock:
+    # Runs a cycle on the Tk main thread against absolute deadlines on the monotonic clock: tick n is due at start + n * interval
+    # whatever earlier ticks cost, so render time never adds up into drift. Deadlines fall on whole multiples of the interval
+    # on the wall clock, so screens with synced clocks tick together.
+    # prepare() runs early enough before each deadline to return a Future that is done by then; tick(future) runs at the deadline.
+    def __init__(self, widget, interval, prepare, tick, on_miss=None, tolerance=0.02, min_lead=0.05):
+        self.widget = widget
+        self.interval = interval
+        self.prepare = prepare
+        self.tick = tick
+        self.on_miss = on_miss  # Called as on_miss(lateness, ready) when a tick is late or its board was not ready
+        self.tolerance = tolerance  # Seconds a tick may run late before it counts as missed
+        self.min_lead = min_lead
+        self.build_times = deque(maxlen=20)  # Seconds recent prepared futures took to finish
+        self.job = None
+        self.pending = None
+        self.running = False
+        self.ticks = 0
+        self.misses = 0
+
+    def start(self):
+        self.stop()
+        self.running = True
+        now = time.monotonic()
+        self.start_time = now + (self.interval - time.time() % self.interval) - self.interval
+        self.n = 0
+        self.schedule_next()
+
+    def stop(self):
+        self.running = False
+        self.pending = None
+        if self.job is not None:
+            self.widget.after_cancel(self.job)
+            self.job = None
+
+    def lead(self):
+        # Start early by the slowest recent build plus half again, but never more than an interval ahead
+        return min(self.interval, max(self.min_lead, max(self.build_times, default=0) * 1.5))
+
+    def at(self, when, callback):
+        self.job = self.widget.after(max(0, int((when - time.monotonic()) * 1000)), callback)
+
+    def schedule_next(self):
+        self.n += 1
+        self.deadline = self.start_time + self.n * self.interval
+        self.at(self.deadline - self.lead(), self.prepare_tick)
+
+    def prepare_tick(self):
+        self.job = None
+        if not self.running:
+            return
+        started = time.monotonic()
+        self.pending = self.prepare()
+        if self.pending is not None:
+            # Runs on whichever thread finishes the future, or right here if it already has
+            self.pending.add_done_callback(lambda future: self.build_times.append(time.monotonic() - started))
+        self.at(self.deadline, self.fire)
+
+    def fire(self):
+        self.job = None
+        if not self.running:
+            return
+        lateness = time.monotonic() - self.deadline
+        if lateness < -0.001:
+            # Tk timers work in whole milliseconds and can come in a little early
+            self.at(self.deadline, self.fire)
+            return
+
+        future, self.pending = self.pending, None
+        ready = future is None or future.done()
+        self.ticks += 1
+        stage_timings.record("cycle_lateness", max(0.0, lateness))
+        if lateness > self.tolerance or not ready:
+            self.misses += 1
+            if self.on_miss:
+                self.on_miss(lateness, ready)
+        self.tick(future)
+
+        # A main thread stuck for whole intervals skips the ticks it can no longer make rather than bunching them up
+        due = int((time.monotonic() - self.start_time) // self.interval)
+        if due > self.n:
+            self.misses += due - self.n
+            self.n = due
+        if self.running:
+            self.schedule_next()
+
+class RenderScheduler:
+    # Hands work finished on worker threads to the Tk main thread, dropping results a newer navigation made stale
+    def __init__(self, widget, poll_ms=15):
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.widget.after(self.poll_ms, self.poll)
+
+    def next_generation(self):
+        # Every navigation starts a new generation; results tagged with an older one are never shown
+        with self.lock:
+            self.generation += 1
+            return self.generation
+
+    def submit(self, generation, future, callback):
+        # callback(result) runs on the main thread once future is done, if generation is still the latest
+        future.add_done_callback(lambda f: self.results.put((generation, callback, f)))
+
+    def post(self, callback, *args):
+        # Runs callback(*args) on the main thread; safe to call from any thread
+        self.results.put((None, callback, args))
+
+    def poll(self):
+        try:
+            while True:
+                try:
+                    generation, callback, payload = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+                if generation is None:
+                    callback(*payload)
+                    continue
+                if generation != self.generation or payload.cancelled():
+                    continue
+                error = payload.exception()
+                if error is not None:
+                    print(f"Error building board: {error}")
+                    continue
+                callback(payload.result())
+        finally:
+            self.widget.after(self.poll_ms, self.poll)
+
+def probe_sizes(image_paths, library=None):
+    # (width, height) per path from the library index, falling back to reading file headers; None if unreadable
+    indexed = library.dimensions(image_paths) if library else {}
+    return [indexed.get(path) or image_size(path) for path in image_paths]
+
+# Above this many images a packed layout costs hundreds of milliseconds, every repack scanning hundreds of free
+# rectangles per image, while justified rows are as dense at that count and take a few. The viewer switches to rows
+# past it; layout_board itself always uses the method it is given.
+MAX_PACKED_IMAGES = 100
+
+def layout_board(sizes, bin_width, bin_height, method='maxrects'):
+    # Pure layout over (width, height) tuples: one (x, y, width, height) per size, no pixels involved.
+    # method is 'rows' for justified rows, otherwise one of PACKERS.
+    with stage_timings.timed("packing"):
+        if method == 'rows':
+            return justified_layout(sizes, bin_width, bin_height)
+        return fit_layout(sizes, bin_width, bin_height, method)
+
+class BoardLayout:
+    # Where each image of a board goes, in the coordinates of the bin it was laid out for
+    def __init__(self, paths, rects, width, height):
+        self.paths = paths
+        self.rects = rects
+        self.width = width
+        self.height = height
+
+    def scaled(self, bin_width, bin_height):
+        # The same layout fitted into another bin; edges are rounded, not sizes, so neighbours never overlap
+        scale = min(bin_width / self.width, bin_height / self.height)
+        return [(int(x * scale), int(y * scale), int((x + w) * scale) - int(x * scale), int((y + h) * scale) - int(y * scale))
+                for x, y, w, h in self.rects]
+
+def plan_board(image_paths, bin_width, bin_height, library=None, method='maxrects'):
+    # Lay the board out from image dimensions alone, skipping files that can't be read
+    placed = [(path, size) for path, size in zip(image_paths, probe_sizes(image_paths, library)) if size]
+    rects = layout_board([size for path, size in placed], bin_width, bin_height, method)
+    return BoardLayout([path for path, size in placed], rects, bin_width, bin_height)
+
+class CanvasPool:
+    # Board-sized buffers reused instead of allocating a new canvas per board.
+    # A buffer out of the pool has holders that each hand it back explicitly: the board cache while the board is cached,
+    # the prefetcher while it is in its window, the viewer while it is on screen. It is reused once the last one lets go.
+    def __init__(self, max_per_mode=2):
+        self.max_per_mode = max_per_mode
+        self.lock = threading.RLock()  # Also taken by the weakref callback, which can run wherever a buffer is collected
+        # Only buffers of the board size last asked for are kept: after a window resize the old size never comes back
+        self.size = None
+        self.free = {}  # mode -> [images] of self.size
+        self.held = {}  # id(buffer) -> [weak reference, holders] for buffers out of the pool
+
+    def acquire(self, mode, size, color):
+        # The caller is the buffer's first holder
+        with self.lock:
+            if size != self.size:
+                self.size = size
+                self.free = {}
+            buffers = self.free.get(mode)
+            img = buffers.pop() if buffers else None
+        if img is None:
+            img = Image.new(mode, size, color)
+        else:
+            img.paste(color, (0, 0) + size)
+        with self.lock:
+            # Weak, so a buffer a holder never hands back is simply collected instead of kept here
+            self.held[id(img)] = [weakref.ref(img, functools.partial(self.forget, id(img))), 1]
+        return img
+
+    def forget(self, key, ref):
+        with self.lock:
+            entry = self.held.get(key)
+            if entry is not None and entry[0] is ref:
+                del self.held[key]
+
+    def entry(self, img):
+        # Bookkeeping for a buffer from this pool; None for any other image, such as a board mapped from shared memory
+        entry = self.held.get(id(img))
+        return entry if entry is not None and entry[0]() is img else None
+
+    def hold(self, img):
+        with self.lock:
+            entry = self.entry(img)
+            if entry is not None:
+                entry[1] += 1
+
+    def release(self, img):
+        with self.lock:
+            entry = self.entry(img)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.held[id(img)]
+            if img.size != self.size:
+                return
+            buffers = self.free.setdefault(img.mode, [])
+            if len(buffers) < self.max_per_mode:
+                buffers.append(img)
+
+    def recycle(self, key, img):
+        # ImageLRU eviction hook: of everything in a shared cache only whole boards came from the pool
+        if key[0] == 'board':
+            self.release(img)
+
+def compose_board(layout, bin_width, bin_height, thumb_cache=None, pool=None, background=(0, 0, 0), image_cache=None):
+    # Decode each image only once its place is known, at the size it takes on the board
+    rects = layout.scaled(bin_width, bin_height)
+    images = [load_image(path, rect[2:], thumb_cache, image_cache) for path, rect in zip(layout.paths, rects)]
+
+    # RGB unless some image is see-through; every board for one window size shares a buffer size,
+    # so the group is centred on a full bin-sized canvas
+    mode = 'RGBA' if any(img.mode == 'RGBA' for img in images) else 'RGB'
+    background = tuple(background[:3]) + (0,) if mode == 'RGBA' else tuple(background[:3])
+    board = pool.acquire(mode, (bin_width, bin_height), background) if pool else Image.new(mode, (bin_width, bin_height), background)
+    if not rects:
+        return board
+    offset_x = (bin_width - max(x + w for x, y, w, h in rects)) // 2
+    offset_y = (bin_height - max(y + h for x, y, w, h in rects)) // 2
+    for img, (x, y, w, h) in zip(images, rects):
+        if img.size != (w, h):
+            img = img.resize((w, h), Image.Resampling.LANCZOS)
+        board.paste(img, (x + offset_x, y + offset_y))
+    return board
+
+def build_mood_board(image_paths, bin_width=4096, bin_height=4096, thumb_cache=None, library=None, method='maxrects'):
+    return compose_board(plan_board(image_paths, bin_width, bin_height, library, method), bin_width, bin_height, thumb_cache)
+
+worker_thumb_cache = None  # Each composer process opens the thumbnail cache once, without a budget of its own
+
+def compose_shared(layout, bin_width, bin_height, shm_name, thumb_cache_dir=None):
+    # Runs in a composer process: builds the board and copies its pixels into the parent's shared-memory block.
+    # The parent created the block and unlinks it; attaching only registers it again with the same resource tracker.
+    # Returns the raw mode and the thumbnails used, which the parent accounts for and evicts.
+    global worker_thumb_cache
+    if thumb_cache_dir and worker_thumb_cache is None:
+        worker_thumb_cache = ThumbnailCache(thumb_cache_dir, max_bytes=None)
+    board = compose_board(layout, bin_width, bin_height, worker_thumb_cache)
+    used = worker_thumb_cache.take_used() if worker_thumb_cache else []
+
+    # RGB pixels go out padded to four bytes, the layout Pillow keeps them in, so the parent can map them as they are
+    raw_mode = 'RGBA' if board.mode == 'RGBA' else 'RGBX'
+    data = board.tobytes('raw', raw_mode)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return raw_mode, used
+
+class SharedBlock(shared_memory.SharedMemory):
+    # A board may still map the block when the interpreter exits; the OS unmaps it then, so that is not an error
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+class SharedBoardComposer:
+    # Optional stand-in for compose_board that decodes and resamples in worker processes, away from Tk and the GIL.
+    # Finished boards come back in shared-memory blocks that are wrapped with Image.frombuffer, not copied;
+    # RGB boards arrive as RGBX, which draws the same.
+    def __init__(self, workers=None, thumb_cache=None):
+        # Spawned rather than forked: forking a process that runs Tk and worker threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+        self.thumb_cache = thumb_cache  # Workers share its directory; its budget is kept here, in this process
+        self.thumb_cache_dir = thumb_cache.cache_dir if thumb_cache else None
+        self.lock = threading.Lock()
+        self.retired = []  # Blocks of collected boards, closed once their pixels are no longer mapped
+
+    def compose(self, layout, bin_width, bin_height):
+        # Called from a prefetch thread, which waits here while a process builds the board
+        self.reap()
+        shm = SharedBlock(create=True, size=bin_width * bin_height * 4)
+        try:
+            raw_mode, used = self.executor.submit(compose_shared, layout, bin_width, bin_height, shm.name, self.thumb_cache_dir).result()
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        if used:
+            self.thumb_cache.add(used)
+        # The name is not needed any more; the memory itself stays until the last mapping of it goes
+        shm.unlink()
+        board = Image.frombuffer(raw_mode, (bin_width, bin_height), shm.buf, 'raw', raw_mode, 0, 1)
+        weakref.finalize(board, self.retire, shm)
+        return board
+
+    def retire(self, shm):
+        # Runs as the board is collected, while its pixel buffer still holds the mapping, so closing waits for reap
+        with self.lock:
+            self.retired.append(shm)
+
+    def reap(self):
+        with self.lock:
+            retired, self.retired = self.retired, []
+        for shm in retired:
+            try:
+                shm.close()
+            except BufferError:
+                with self.lock:
+                    self.retired.append(shm)
+
+    def shutdown(self):
+        # Queued boards are dropped, the ones being built are waited for so their blocks are unlinked
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.reap()
+
+def image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+class ImageLRU:
+    # Least-recently-used images under a byte budget, counted as width x height x bands.
+    # Keys are tuples whose first item names the kind of entry, so one budget can hold decodes, boards and tiles.
+    def __init__(self, max_bytes, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict  # Called with (key, image) for each entry that leaves the cache
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> image, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, hold=None):
+        # hold, if given, is called with the image under the cache's lock, so the entry can't leave the cache in between
+        with self.lock:
+            img = self.entries.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            if hold:
+                hold(img)
+            return img
+
+    def put(self, key, img):
+        with self.lock:
+            if key in self.entries:
+                replaced = self.entries.pop(key)
+                self.total_bytes -= image_bytes(replaced)
+                if self.on_evict and replaced is not img:
+                    self.on_evict(key, replaced)
+            self.entries[key] = img
+            self.total_bytes += image_bytes(img)
+            # The newest entry always stays, even if it alone is over budget
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= image_bytes(evicted)
+                self.evictions += 1
+                if self.on_evict:
+                    self.on_evict(evicted_key, evicted)
+
+    def discard_where(self, match):
+        with self.lock:
+            for key in [key for key in self.entries if match(key)]:
+                img = self.entries.pop(key)
+                self.total_bytes -= image_bytes(img)
+                if self.on_evict:
+                    self.on_evict(key, img)
+
+    def stats(self):
+        with self.lock:
+            by_kind = {}
+            for key, img in self.entries.items():
+                kind = key[0] if isinstance(key, tuple) else None
+                entries, size = by_kind.get(kind, (0, 0))
+                by_kind[kind] = (entries + 1, size + image_bytes(img))
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "by_kind": {kind: {"entries": entries, "bytes": size} for kind, (entries, size) in by_kind.items()},
+            }
+
+class BoardCache:
+    # Two levels: image paths + layout parameters -> layout, then layout + output size -> composed board.
+    # Layouts are made for a reference bin per aspect-ratio step, so a window resize reuses the layout and only recomposes.
+    LAYOUT_SIDE = 4096
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, max_layouts=4096, aspect_step=0.1, pool=None, image_cache=None, composer=None):
+        self.aspect_step = aspect_step
+        self.pool = pool  # Boards are composed into buffers from this CanvasPool
+        self.composer = composer  # A SharedBoardComposer builds boards in other processes instead
+        self.max_layouts = max_layouts
+        self.lock = threading.Lock()
+        self.layouts = OrderedDict()  # (paths, method, aspect) -> BoardLayout
+        # Boards and the decodes they are made of share one budget; given a shared cache, max_bytes is its business
+        self.images = image_cache if image_cache is not None else ImageLRU(max_bytes, pool.recycle if pool else None)
+
+    def layout_key(self, image_paths, bin_width, bin_height, method):
+        aspect = max(self.aspect_step, round(bin_width / bin_height / self.aspect_step) * self.aspect_step)
+        return (tuple(image_paths), method, round(aspect, 3))
+
+    def hold(self, board):
+        if self.pool:
+            self.pool.hold(board)
+
+    def cached(self, image_paths, bin_width, bin_height, method='maxrects'):
+        # The composed board if it is already here, without building anything; like board(), held once for the caller
+        return self.images.get(('board', self.layout_key(image_paths, bin_width, bin_height, method), bin_width, bin_height), self.hold)
+
+    def layout(self, key, library=None):
+        with self.lock:
+            layout = self.layouts.get(key)
+            if layout is not None:
+                self.layouts.move_to_end(key)
+                return layout
+
+        image_paths, method, aspect = key
+        if aspect >= 1:
+            width, height = self.LAYOUT_SIDE, int(self.LAYOUT_SIDE / aspect)
+        else:
+            width, height = int(self.LAYOUT_SIDE * aspect), self.LAYOUT_SIDE
+        layout = plan_board(list(image_paths), width, height, library, method)
+
+        with self.lock:
+            self.layouts[key] = layout
+            if len(self.layouts) > self.max_layouts:
+                self.layouts.popitem(last=False)
+        return layout
+
+    def board(self, image_paths, bin_width, bin_height, thumb_cache=None, library=None, method='maxrects'):
+        # A pooled board comes back held once for the caller, who hands it back with pool.release when done with it
+        key = self.layout_key(image_paths, bin_width, bin_height, method)
+        board = self.images.get(('board', key, bin_width, bin_height), self.hold)
+        if board is None:
+            layout = self.layout(key, library)
+            with stage_timings.timed("compose"):
+                if self.composer:
+                    board = self.composer.compose(layout, bin_width, bin_height)
+                else:
+                    board = compose_board(layout, bin_width, bin_height, thumb_cache, self.pool, image_cache=self.images)
+            # compose_board's hold goes to the caller, the cache takes its own
+            self.hold(board)
+            self.images.put(('board', key, bin_width, bin_height), board)
+        return board
+
+    def forget(self, image_paths):
+        # Decodes of changed or removed files; layouts and boards holding them are dropped by their path tuples
+        image_paths = set(image_paths)
+        with self.lock:
+            for key in [key for key in self.layouts if not image_paths.isdisjoint(key[0])]:
+                del self.layouts[key]
+        self.images.discard_where(lambda key: (key[0] == 'image' and key[1] in image_paths) or
+                                  (key[0] == 'board' and not image_paths.isdisjoint(key[1][0])))
+
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
@@ -134,6 +1685,20 @@ class ScreenRegionSelector(ctk.CTk):
 
 
 
+openai_client_instance = None
+openai_client_lock = threading.Lock()
+
+def openai_client():
+    # openai and dotenv take longer to import than the window takes to draw, so they wait for the first request
+    global openai_client_instance
+    with openai_client_lock:
+        if openai_client_instance is None:
+            from dotenv import load_dotenv
+            from openai import OpenAI
+            load_dotenv()
+            openai_client_instance = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return openai_client_instance
+
 class ConversationBuffer:
     def __init__(self, max_tokens=100000):
         self.max_tokens = max_tokens
@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import PIL
+from PIL import Image, ImageTk
+
+from aux_func import *
+
+def make_flat_folder(folder, count, size=(640, 480)):
+    # One real JPEG copied count times; listing cost depends on the number of entries, not on the pixels
+    os.makedirs(folder, exist_ok=True)
+    source = os.path.join(folder, "ref_000000.jpg")
+    Image.effect_noise(size, 40).convert("RGB").save(source, quality=85)
+    for i in range(1, count):
+        shutil.copyfile(source, os.path.join(folder, f"ref_{i:06d}.jpg"))
+
+def best_of(repeats, func):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def bench_time_to_first_board(folder, images_per_board=3, target_size=(1100, 600), repeats=3):
+    def full_listing():
+        # The whole folder is listed before the first board is built
+        paths = list_images(folder)
+        build_mood_board(paths[:images_per_board], *target_size)
+
+    def streaming_listing():
+        # The first board is built as soon as enough images are known
+        first = []
+        for path in iter_images(folder):
+            first.append(path)
+            if len(first) == images_per_board:
+                break
+        build_mood_board(first, *target_size)
+
+    return {
+        "full_listing_s": best_of(repeats, full_listing),
+        "streaming_s": best_of(repeats, streaming_listing),
+    }
+
+def random_sizes(count, seed=0):
+    # Photo-like dimensions: 400 to 6000 px on a side, any aspect ratio in between
+    rng = random.Random(seed)
+    return [(rng.randint(400, 6000), rng.randint(400, 6000)) for _ in range(count)]
+
+def bench_packing(counts=(3, 10, 50, 500), board_size=(2200, 1200), repeats=3):
+    # Density is the share of the board covered by images once the layout has been scaled to fit
+    results = []
+    for count in counts:
+        sizes = random_sizes(count, seed=count)
+        for method in list(PACKERS) + ['rows']:
+            # The layout functions directly, so each method is measured as itself at every count
+            layout = justified_layout if method == 'rows' else lambda *args: fit_layout(*args, method)
+            rects = layout(sizes, board_size[0], board_size[1])
+            density = sum(w * h for x, y, w, h in rects) / (board_size[0] * board_size[1])
+            seconds = best_of(repeats, lambda: layout(sizes, board_size[0], board_size[1]))
+            results.append({"images": count, "method": method, "density": density, "seconds": seconds})
+    return results
+
+CORPUS_FORMATS = ('jpg', 'png', 'gif', 'bmp')
+
+def generate_corpus(folder, count=60, min_side=400, max_side=3000, formats=('jpg', 'png'), alpha=0.2, seed=0):
+    # count random references between min_side and max_side px, cycling through formats;
+    # about an alpha share of them are see-through, written as PNG since the other formats can't carry it
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        size = (rng.randint(min_side, max_side), rng.randint(min_side, max_side))
+        # Noise at a low resolution scaled up: photo-like detail without paying for noise at full size
+        img = Image.effect_noise((max(1, size[0] // 8), max(1, size[1] // 8)), 60).resize(size, Image.Resampling.BILINEAR)
+        fmt = formats[i % len(formats)]
+        if rng.random() < alpha:
+            img = img.convert('RGBA')
+            img.putalpha(img.getchannel('R').point(lambda v: 255 if v > 96 else 0))
+            fmt = 'png'
+        path = os.path.join(folder, f"ref_{i:04d}.{fmt}")
+        if fmt == 'jpg':
+            img.convert('RGB').save(path, quality=90)
+        elif fmt == 'gif':
+            img.convert('P').save(path)
+        elif fmt == 'bmp':
+            img.convert('RGB').save(path)
+        else:
+            img.save(path)
+        paths.append(path)
+    return paths
+
+def summarize(timings):
+    return {
+        "n": len(timings),
+        "median_ms": percentile(timings, 0.5) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "min_ms": min(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+    }
+
+def tk_root():
+    # PhotoImage needs a Tk interpreter but not a visible window; None where there is no display at all
+    try:
+        import tkinter
+        root = tkinter.Tk()
+        root.withdraw()
+        return root
+    except Exception:
+        return None
+
+def bench_pipeline(paths, boards=20, images_per_board=3, board_size=(2200, 1200), view_size=(1100, 600), zoom_scales=(0.5, 1.0, 2.0), method='maxrects', seed=0):
+    # Times every stage a board goes through, in isolation, on a fresh random pick of references per board
+    rng = random.Random(seed)
+    timings = {}
+    root = tk_root()
+
+    def timed(stage, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - started)
+        return result
+
+    for _ in range(boards):
+        chosen = rng.sample(paths, min(images_per_board, len(paths)))
+
+        # The packing pipeline the Pro variants use: lazy full-size images, packed, then pasted
+        images = timed("load_images", load_images, chosen)
+        bins = timed("bin_packing", bin_packing, images, *board_size, method)
+        timed("create_packed_image", create_packed_image, bins)
+        del images, bins
+
+        # The viewer's pipeline: laid out from headers, each image decoded at the size it is placed at
+        layout = timed("plan_board", plan_board, chosen, *board_size, None, method)
+        board = timed("compose_board", compose_board, layout, *board_size)
+
+        # The zoom resize in display_image: first draw of a new board (cuts its tiles), then redraws at a few zoom levels
+        pyramid = TilePyramid(board)
+        fit = min(view_size[0] / board.width, view_size[1] / board.height)
+        origin = ((view_size[0] - board.width * fit) / 2, (view_size[1] - board.height * fit) / 2)
+        view = timed("first_draw", pyramid.render, fit, origin, view_size)
+        for zoom in zoom_scales:
+            scale = fit * zoom
+            origin = ((view_size[0] - board.width * scale) / 2, (view_size[1] - board.height * scale) / 2)
+            timed("zoom_preview", pyramid.render, scale, origin, view_size, Image.Resampling.BILINEAR)
+            view = timed("zoom_render", pyramid.render, scale, origin, view_size)
+        pyramid.release()
+
+        if root is not None:
+            timed("photoimage", ImageTk.PhotoImage, view)
+
+    if root is not None:
+        root.destroy()
+    return {stage: summarize(values) for stage, values in timings.items()}
+
+def compare_results(results, baseline, threshold, min_delta_ms=1.0):
+    # Stages whose median got slower than the baseline's by more than threshold (0.1 = 10%) and by at least
+    # min_delta_ms, so timer noise on sub-millisecond stages is not a regression
+    regressions = []
+    for stage, summary in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if (before and before["median_ms"] > 0 and summary["median_ms"] > before["median_ms"] * (1 + threshold)
+                and summary["median_ms"] - before["median_ms"] >= min_delta_ms):
+            regressions.append((stage, before["median_ms"], summary["median_ms"]))
+    return regressions
+
+def run_pipeline(args):
+    temp_dir = None
+    if args.folder:
+        paths = list_images(args.folder)
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="refcycler_bench_")
+        paths = generate_corpus(os.path.join(temp_dir, "refs"), args.count, args.min_side, args.max_side, args.formats, args.alpha)
+
+    try:
+        config = {key: value for key, value in vars(args).items() if key not in ("func", "output", "baseline")}
+        stages = bench_pipeline(paths, args.boards, args.images_per_board, (args.width, args.height), (args.view_width, args.view_height), method=args.layout)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = {
+        "config": config,
+        "python": sys.version.split()[0],
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "stages": stages,
+    }
+    for stage, summary in stages.items():
+        print(f"{stage:<20} median {summary['median_ms']:8.1f} ms  p95 {summary['p95_ms']:8.1f} ms  max {summary['max_ms']:8.1f} ms")
+    if "photoimage" not in stages:
+        print("photoimage: skipped, no display for Tk")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.threshold, args.min_delta_ms)
+        for stage, before, after in regressions:
+            print(f"REGRESSION {stage}: {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+STARTUP_SCRIPTS = ('RefCycler', 'RefCycler_pro', 'RefCycler_pro_02')
+
+# Runs in a fresh interpreter: imports the app module, builds its window and reports when the first frame is drawn
+FIRST_FRAME_DRIVER = """
+import os, sys, time
+sys.path.insert(0, {folder!r})
+import {module} as app_module
+print("IMPORTED", time.time(), flush=True)
+app = app_module.ImageCyclerApp()
+
+def drawn():
+    app.update_idletasks()
+    print("FIRST_FRAME", time.time(), flush=True)
+    os._exit(0)  # Without stopping hotkey and cycling threads
+
+app.bind("<Map>", lambda event: app.after_idle(drawn) if event.widget is app else None)
+app.mainloop()
+"""
+
+def import_times(module, folder):
+    # -X importtime of a fresh interpreter importing module: (cumulative us, self us, name) per import, and the total
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=folder, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        try:
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+        except ValueError:
+            continue  # Column headers
+        if len(name) - len(name.lstrip()) == 1:
+            total_us += int(cumulative_us)  # Top-level imports only; nested ones are inside their cumulative time
+    rows.sort(reverse=True)
+    return total_us, rows
+
+def first_frame_time(module, folder, timeout=60):
+    # Seconds from launching the interpreter to the module imported and to the first frame drawn.
+    # The app runs in an empty home, so it doesn't restore the user's session and rescan their library meanwhile.
+    home = tempfile.mkdtemp(prefix="refcycler_startup_")
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    driver = FIRST_FRAME_DRIVER.format(folder=os.path.abspath(folder), module=module)
+    try:
+        started = time.time()
+        result = subprocess.run([sys.executable, "-c", driver], cwd=folder, env=env, capture_output=True, text=True, timeout=timeout)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    marks = dict(line.split() for line in result.stdout.splitlines() if line.startswith(("IMPORTED", "FIRST_FRAME")))
+    if "FIRST_FRAME" not in marks:
+        raise RuntimeError((result.stderr.strip().splitlines() or ["no first frame"])[-1])
+    return float(marks["IMPORTED"]) - started, float(marks["FIRST_FRAME"]) - started
+
+def run_startup(args):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in args.scripts:
+        result = results[module] = {}
+        try:
+            total_us, rows = import_times(module, folder)
+            result["import_s"] = total_us / 1e6
+            result["slowest_imports"] = [{"module": name, "cumulative_ms": cumulative / 1000, "self_ms": own / 1000} for cumulative, own, name in rows[:args.top]]
+            print(f"{module}: imports take {total_us / 1000:.0f} ms")
+            for cumulative, own, name in rows[:args.top]:
+                print(f"    {cumulative / 1000:8.1f} ms  {name}")
+        except RuntimeError as e:
+            print(f"{module}: import failed: {e}")
+            continue
+
+        try:
+            timings = [first_frame_time(module, folder) for _ in range(args.repeats)]
+            result["to_imported_s"] = min(imported for imported, frame in timings)
+            result["to_first_frame_s"] = min(frame for imported, frame in timings)
+            print(f"{module}: imported after {result['to_imported_s'] * 1000:.0f} ms, first frame after {result['to_first_frame_s'] * 1000:.0f} ms")
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"{module}: no first frame measured ({e})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+def run_packing(args):
+    for result in bench_packing(board_size=(args.width, args.height)):
+        print(f"{result['images']:>4} images  {result['method']:<9} density {result['density']:.3f}  {result['seconds'] * 1000:8.1f} ms")
+
+def run_ttfb(args):
+    folder = args.folder
+    temp_dir = None
+    if folder is None:
+        temp_dir = tempfile.mkdtemp(prefix="refcycler_bench_")
+        folder = os.path.join(temp_dir, "refs")
+        print(f"Generating {args.count} files in {folder}...")
+        make_flat_folder(folder, args.count)
+
+    try:
+        results = bench_time_to_first_board(folder, args.images_per_board)
+        for name, seconds in results.items():
+            print(f"{name}: {seconds * 1000:.1f} ms")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RefCycler performance benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ttfb = commands.add_parser("ttfb", help="Time to first board for a large folder")
+    ttfb.add_argument("--folder", help="Existing folder to measure instead of a synthetic one")
+    ttfb.add_argument("--count", type=int, default=50000, help="Number of files in the synthetic folder")
+    ttfb.add_argument("--images-per-board", type=int, default=3)
+    ttfb.set_defaults(func=run_ttfb)
+
+    packing = commands.add_parser("packing", help="Packing density and layout time per layout method")
+    packing.add_argument("--width", type=int, default=2200)
+    packing.add_argument("--height", type=int, default=1200)
+    packing.set_defaults(func=run_packing)
+
+    pipeline = commands.add_parser("pipeline", help="Time each stage of building and showing a board on a synthetic corpus")
+    pipeline.add_argument("--folder", help="Existing folder of references instead of a synthetic corpus")
+    pipeline.add_argument("--count", type=int, default=60, help="Images in the synthetic corpus")
+    pipeline.add_argument("--min-side", type=int, default=400)
+    pipeline.add_argument("--max-side", type=int, default=3000)
+    pipeline.add_argument("--formats", nargs="+", choices=CORPUS_FORMATS, default=["jpg", "png"])
+    pipeline.add_argument("--alpha", type=float, default=0.2, help="Share of see-through images")
+    pipeline.add_argument("--boards", type=int, default=20)
+    pipeline.add_argument("--images-per-board", type=int, default=3)
+    pipeline.add_argument("--layout", choices=sorted(PACKERS) + ["rows"], default="maxrects")
+    pipeline.add_argument("--width", type=int, default=2200, help="Board width")
+    pipeline.add_argument("--height", type=int, default=1200, help="Board height")
+    pipeline.add_argument("--view-width", type=int, default=1100, help="Canvas width the board is drawn into")
+    pipeline.add_argument("--view-height", type=int, default=600)
+    pipeline.add_argument("--output", help="Write the results to this JSON file")
+    pipeline.add_argument("--baseline", help="Earlier JSON results to compare against; exits 1 on a regression")
+    pipeline.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown of a stage's median (0.15 = 15%%)")
+    pipeline.add_argument("--min-delta-ms", type=float, default=1.0, help="Slowdowns smaller than this many milliseconds never count")
+    pipeline.set_defaults(func=run_pipeline)
+
+    startup = commands.add_parser("startup", help="Import time and time to first frame of the app entry points")
+    startup.add_argument("--scripts", nargs="+", choices=STARTUP_SCRIPTS, default=list(STARTUP_SCRIPTS))
+    startup.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    startup.add_argument("--repeats", type=int, default=3, help="Launches per script; the fastest counts")
+    startup.add_argument("--output", help="Write the results to this JSON file")
+    startup.set_defaults(func=run_startup)
+
+    args = parser.parse_args()
+    args.func(args)
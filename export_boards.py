@@ -0,0 +1,122 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from PIL import Image
+
+from aux_func import *
+
+FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'pdf': 'PDF'}
+
+def find_pages(root, per_page):
+    # (folder, page number, image paths) for every folder under root that holds images, pages in name order
+    pages = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        images = sorted(os.path.join(folder, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        for start in range(0, len(images), per_page):
+            pages.append((folder, start // per_page + 1, images[start:start + per_page]))
+    return pages
+
+def output_stem(root, output, folder):
+    # The library's folder tree is kept under output, starting at root's own name: refs/a/b gives output/refs/a/b,
+    # so no two folders share a name the way a flattened a_b would
+    name = os.path.basename(os.path.abspath(root))
+    return os.path.join(output, name) if folder == root else os.path.join(output, name, os.path.relpath(folder, root))
+
+def page_file(root, output, folder, number, extension):
+    return f"{output_stem(root, output, folder)}_p{number:03d}.{extension}"
+
+def render_page(image_paths, page_size, method, out_path, fmt):
+    # Runs in a worker process: lays out one page from headers, decodes its images at placed size and writes it out.
+    # Only this page's images are ever decoded in this process.
+    width, height = page_size
+    board = compose_board(plan_board(image_paths, width, height, None, method), width, height, background=(255, 255, 255))
+    if board.mode == 'RGBA':
+        # Print formats get a white page under transparent references
+        page = Image.new('RGB', board.size, (255, 255, 255))
+        page.paste(board, mask=board.getchannel('A'))
+        board = page
+
+    if fmt == 'PDF':
+        # Pages are written as JPEG first and appended to the folder's PDF in order by the main process
+        board.save(out_path, 'JPEG', quality=95)
+    elif fmt == 'JPEG':
+        board.save(out_path, 'JPEG', quality=92)
+    else:
+        board.save(out_path, 'PNG')
+    return out_path
+
+def append_pdf_page(pdf_path, page_path, first, resolution):
+    with Image.open(page_path) as page:
+        page.save(pdf_path, 'PDF', resolution=resolution, append=not first)
+    os.remove(page_path)
+
+def export_boards(root, output, per_page=12, page_size=(3508, 2480), method='maxrects', fmt='JPEG', workers=None, max_in_flight=None, resolution=300):
+    os.makedirs(output, exist_ok=True)
+    pages = find_pages(root, per_page)
+    workers = workers or os.cpu_count() or 1
+    # Each page in flight holds its decoded images and one board, so this bounds memory
+    max_in_flight = max_in_flight or workers * 2
+    print(f"Exporting {len(pages)} pages from {root} with {workers} workers...")
+
+    started = time.time()
+    pending = {}
+    pdf_pages = {}  # folder -> {page number: finished page path}, drained in page order
+    pdf_next = {}  # folder -> next page number to append
+    todo = iter(pages)
+    done_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # Stream work in: never more than max_in_flight pages decoded at once
+            for folder, number, paths in todo:
+                extension = 'jpg' if fmt in ('JPEG', 'PDF') else 'png'
+                out_path = page_file(root, output, folder, number, extension)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                future = executor.submit(render_page, paths, page_size, method, out_path, fmt)
+                pending[future] = (folder, number)
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                folder, number = pending.pop(future)
+                try:
+                    page_path = future.result()
+                except Exception as e:
+                    print(f"Page {number} of {folder} failed: {e}")
+                    page_path = None
+                done_count += 1
+
+                if fmt == 'PDF':
+                    pdf_pages.setdefault(folder, {})[number] = page_path
+                    pdf_next.setdefault(folder, 1)
+                    pdf_path = output_stem(root, output, folder) + ".pdf"
+                    while pdf_next[folder] in pdf_pages[folder]:
+                        ready = pdf_pages[folder].pop(pdf_next[folder])
+                        if ready:
+                            append_pdf_page(pdf_path, ready, pdf_next[folder] == 1 or not os.path.exists(pdf_path), resolution)
+                            print(f"[{done_count}/{len(pages)}] {pdf_path} page {pdf_next[folder]}")
+                        pdf_next[folder] += 1
+                elif page_path:
+                    print(f"[{done_count}/{len(pages)}] {page_path}")
+
+    elapsed = time.time() - started
+    print(f"Exported {done_count} pages in {elapsed:.1f}s ({done_count / elapsed if elapsed else 0:.1f} pages/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export every folder of a reference library as paged contact sheets")
+    parser.add_argument("root", help="Library root folder")
+    parser.add_argument("output", help="Folder to write the pages to")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jpg")
+    parser.add_argument("--per-page", type=int, default=12, help="Images per page")
+    parser.add_argument("--page-size", default="3508x2480", help="Page size in pixels, WIDTHxHEIGHT (default A4 landscape at 300 dpi)")
+    parser.add_argument("--layout", choices=sorted(PACKERS) + ["rows"], default="maxrects")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    parser.add_argument("--max-in-flight", type=int, help="Pages decoded at once (default: two per worker)")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.page_size.lower().split("x"))
+    export_boards(os.path.abspath(args.root), args.output, args.per_page, (width, height), args.layout, FORMATS[args.format], args.workers, args.max_in_flight)
@@ -0,0 +1,279 @@
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from PIL import Image
+
+from aux_func import *
+
+def open_fds():
+    # Descriptors this process holds, where the OS lists them; None elsewhere
+    for folder in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(folder):
+            return len(os.listdir(folder))
+    return None
+
+def rss_bytes():
+    # Resident set size right now (not the peak), where the OS exposes it; None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def trim_heap():
+    # Hands free heap pages back to the OS where glibc can (malloc_trim); returns whether it could.
+    # Board-sized buffers of changing sizes leave holes in the heap that RSS keeps counting, which is not a leak.
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        libc.malloc_trim(0)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+def take_sample(board, **extra):
+    # One reading of everything that must not grow; traced is Python-level memory, pixel buffers only show in RSS.
+    # rss is read after trimming the heap, so it follows live memory; rss_raw is what the process held before that.
+    raw = rss_bytes()
+    sample = {"board": board, "fds": open_fds(), "rss": rss_bytes() if trim_heap() else raw, "rss_raw": raw}
+    if tracemalloc.is_tracing():
+        sample["traced"] = tracemalloc.get_traced_memory()[0]
+    sample.update(extra)
+    return sample
+
+def make_corpus(folder, count=24, size=(320, 240)):
+    # Every format and mode load_image meets in a real library: JPEG, PNG with alpha, palette GIF (kept open by Pillow), BMP
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        width, height = size[0] + 17 * i, size[1] + 11 * (i % 5)
+        noise = Image.effect_noise((width, height), 40 + i)
+        kind = i % 4
+        if kind == 0:
+            path = os.path.join(folder, f"ref_{i:03d}.jpg")
+            noise.convert("RGB").save(path, quality=85)
+        elif kind == 1:
+            path = os.path.join(folder, f"ref_{i:03d}.png")
+            img = noise.convert("RGBA")
+            img.putalpha(noise.point(lambda v: v // 2))
+            img.save(path)
+        elif kind == 2:
+            path = os.path.join(folder, f"ref_{i:03d}.gif")
+            frame = noise.convert("P")
+            frame.save(path, save_all=True, append_images=[frame.rotate(180)])
+        else:
+            path = os.path.join(folder, f"ref_{i:03d}.bmp")
+            noise.convert("RGB").save(path)
+        paths.append(path)
+    return paths
+
+def soak_boards(paths, boards=10000, per_board=3, mode='lazy', board_size=(800, 450), sample_every=500, seed=0):
+    # Cycles boards like the viewer would and samples fds and RSS along the way
+    rng = random.Random(seed)
+    samples = []
+    for i in range(boards):
+        chosen = rng.sample(paths, per_board)
+        if mode == 'lazy':
+            # What RefCycler_pro does: full-size lazy images, packed, then pasted
+            board = create_packed_image(bin_packing(load_images(chosen), *board_size))
+        else:
+            # What RefCycler does: laid out from headers, decoded reduced
+            board = build_mood_board(chosen, *board_size)
+        del board
+        if i % sample_every == 0 or i == boards - 1:
+            samples.append(take_sample(i))
+    return samples
+
+# Window sizes a kiosk goes through over a day: the board size follows the canvas, so each one is a new buffer size
+WINDOW_SIZES = [(1100, 600), (1280, 720), (1100, 600), (960, 540), (1600, 900), (1024, 768), (1440, 810), (1100, 600)]
+
+def soak_core(paths, transitions=20000, per_board=3, zooms=2, resize_every=100, sample_every=500, method='maxrects'):
+    # The viewer with the UI stripped off: prefetched boards from the shared caches, shown through a tile pyramid
+    # and zoomed and panned, with a window resize every resize_every transitions
+    pool = CanvasPool()
+    image_cache = ImageLRU(96 * 1024 * 1024, on_evict=pool.recycle)
+    board_cache = BoardCache(pool=pool, image_cache=image_cache)
+
+    def build(images, context):
+        board_size, method = context
+        return board_cache.board(images, *board_size, None, None, method)
+
+    def lookup(images, context):
+        board_size, method = context
+        return board_cache.cached(images, *board_size, method)
+
+    prefetcher = BoardPrefetcher(build, lookup=lookup, release=pool.release)
+    samples = []
+    index = 0
+    current = pyramid = None
+    try:
+        for i in range(transitions):
+            view_size = WINDOW_SIZES[(i // resize_every) % len(WINDOW_SIZES)]
+            board_size = (view_size[0] * 2, view_size[1] * 2)
+            prefetcher.set_context((board_size, method))
+            index = (index + per_board) % len(paths)
+            board = prefetcher.get(board_paths(paths, index, per_board))
+            prefetcher.prefetch(paths, index, per_board)
+
+            if board is not current:
+                if pyramid is not None:
+                    pyramid.release()
+                current, pyramid = board, TilePyramid(board, image_cache=image_cache, pool=pool)
+            del board
+
+            # Zoom in and back out around the centre, panning a little each step, preview then refined like display_image
+            fit = min(view_size[0] / current.width, view_size[1] / current.height)
+            for step in list(range(zooms)) + list(reversed(range(zooms))):
+                scale = fit * 1.1 ** step
+                origin = ((view_size[0] - current.width * scale) / 2 + 7 * step, (view_size[1] - current.height * scale) / 2 - 5 * step)
+                pyramid.render(scale, origin, view_size, Image.Resampling.BILINEAR)
+            pyramid.render(fit, ((view_size[0] - current.width * fit) / 2, (view_size[1] - current.height * fit) / 2), view_size)
+
+            # Not at the very end: the window would be at whatever size the run stopped at
+            if i % sample_every == 0:
+                samples.append(take_sample(i, cache_bytes=image_cache.total_bytes))
+    finally:
+        prefetcher.shutdown()
+    return samples
+
+def pump(app, done, timeout=30.0):
+    # Runs the Tk event loop until done() holds
+    deadline = time.monotonic() + timeout
+    while not done():
+        if time.monotonic() > deadline:
+            raise TimeoutError("the app did not settle")
+        app.update()
+        time.sleep(0.001)
+
+def soak_app(root, transitions=20000, zooms=4, sample_every=500):
+    # The real ImageCyclerApp, driven through its own handlers as if by the arrow keys, mouse wheel and drags.
+    # Needs a display; the cycle clock is off so the harness sets the pace.
+    from RefCycler import ImageCyclerApp
+    app = ImageCyclerApp()
+    app.cycle_switch.deselect()
+    app.toggle_cycling()
+    samples = []
+    try:
+        app.root_folder = root
+        app.refresh_subfolders(root, select_first=True)
+        pump(app, lambda: app.current_image is not None)
+
+        for i in range(transitions):
+            app.show_next_image(None)
+            pump(app, lambda: app.transition_started is None)
+
+            x, y = app.canvas.winfo_width() // 2, app.canvas.winfo_height() // 2
+            for step in range(zooms):
+                app.zoom_image(types.SimpleNamespace(delta=120 if step < zooms // 2 else -120, x=x, y=y))
+                app.start_drag(types.SimpleNamespace(x=x, y=y))
+                app.drag_image(types.SimpleNamespace(x=x + 40, y=y - 25))
+                app.stop_drag(None)
+                app.update()
+            app.reset_zoom(None)
+            pump(app, lambda: app.preview_job is None and app.refine_job is None)
+
+            if i % sample_every == 0 or i == transitions - 1:
+                samples.append(take_sample(i, canvas_items=len(app.canvas.find_all()), cache_bytes=app.image_cache.total_bytes))
+    finally:
+        app.on_close()
+    return samples
+
+def check_flat(samples, slack, warmup):
+    # After warm-up, nothing may climb more than its slack above where it stood
+    failures = []
+    settled = [s for s in samples if s["board"] >= warmup] or samples[-1:]
+    base = settled[0]
+    for sample in settled:
+        for key, allowed in slack.items():
+            if sample.get(key) is None or base.get(key) is None:
+                continue
+            growth = sample[key] - base[key]
+            if growth > allowed:
+                failures.append(f"board {sample['board']}: {key} {sample[key]}, {growth} more than after warm-up (allowed {allowed})")
+    return failures
+
+def describe(sample):
+    parts = [f"board {sample['board']:>6}", f"fds {sample['fds'] if sample['fds'] is not None else '?':>4}"]
+    if sample["rss"]:
+        parts.append(f"RSS {sample['rss'] / 1e6:7.1f} MB ({sample['rss_raw'] / 1e6:.1f} MB untrimmed)")
+    if "traced" in sample:
+        parts.append(f"traced {sample['traced'] / 1e6:6.2f} MB")
+    if "cache_bytes" in sample:
+        parts.append(f"cache {sample['cache_bytes'] / 1e6:6.1f} MB")
+    if "canvas_items" in sample:
+        parts.append(f"canvas items {sample['canvas_items']}")
+    return "  ".join(parts)
+
+def run(args):
+    temp_dir = tempfile.mkdtemp(prefix="refcycler_soak_")
+    # Caches, index and session of the soak stay in the temporary home, away from the user's
+    os.environ["HOME"] = os.environ["USERPROFILE"] = temp_dir
+    try:
+        root = os.path.join(temp_dir, "library")
+        paths = make_corpus(os.path.join(root, "refs"), args.corpus)
+        slack = {"fds": args.fd_slack, "rss": args.rss_slack_mb * 1e6, "traced": args.traced_slack_mb * 1e6, "canvas_items": 0}
+        # With the collector off, anything that only gets freed by it shows up as growth
+        if not args.gc:
+            gc.disable()
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.time()
+        failed = False
+        for mode in args.modes:
+            snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+            warmup = args.warmup
+            if mode == "core":
+                # A bigger window legitimately needs bigger boards, so readings are compared at the same point of the
+                # round of window sizes, with the baseline taken once every size has been through
+                cycle = len(WINDOW_SIZES) * args.resize_every
+                sample_every = cycle * max(1, round(args.sample_every / cycle))
+                samples = soak_core(paths, args.boards, args.images_per_board, args.zooms, args.resize_every, sample_every)
+                warmup = max(warmup, cycle)
+            elif mode == "app":
+                samples = soak_app(root, args.boards, args.zooms * 2, sample_every=args.sample_every)
+            else:
+                samples = soak_boards(paths, args.boards, args.images_per_board, mode, sample_every=args.sample_every)
+            for sample in samples:
+                print(f"{mode:<8} {describe(sample)}")
+
+            failures = check_flat(samples, slack, warmup)
+            for failure in failures:
+                print(f"FAIL {mode}: {failure}")
+            if failures and snapshot is not None:
+                # Where the Python-level growth was allocated
+                for stat in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")[:10]:
+                    print(f"    {stat}")
+            failed = failed or bool(failures)
+        print(f"{'FAILED' if failed else 'OK'} in {time.time() - started:.0f}s")
+        return 1 if failed else 0
+    finally:
+        gc.enable()
+        tracemalloc.stop()
+        image_handles.close_all()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cycle many boards and check that open files, memory and canvas items stay flat")
+    parser.add_argument("--boards", type=int, default=10000, help="Boards, or transitions for the core and app modes")
+    parser.add_argument("--images-per-board", type=int, default=3)
+    parser.add_argument("--corpus", type=int, default=24, help="Number of synthetic reference images")
+    parser.add_argument("--modes", nargs="+", choices=["lazy", "reduced", "core", "app"], default=["lazy", "reduced", "core"],
+                        help="app drives the real window and needs a display")
+    parser.add_argument("--zooms", type=int, default=2, help="Wheel steps in, then out again, with a drag each, per transition (core and app)")
+    parser.add_argument("--resize-every", type=int, default=100, help="Transitions between window resizes in the core mode")
+    parser.add_argument("--sample-every", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=500, help="Boards before the baseline is taken")
+    parser.add_argument("--fd-slack", type=int, default=4)
+    parser.add_argument("--rss-slack-mb", type=float, default=64)
+    parser.add_argument("--traced-slack-mb", type=float, default=4, help="Allowed growth of memory traced by tracemalloc")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false", help="Skip tracemalloc, which slows the run down")
+    parser.add_argument("--gc", action="store_true", help="Leave the garbage collector on")
+    sys.exit(run(parser.parse_args()))